@@ -0,0 +1,108 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import urllib.parse
+
+import plex_poster_set_helper
+from fake_plex_server import FakePlexServer, library_from_posters
+from fixture_corpus import FIXTURES_DIRECTORY, offline_fetch_page, recorded_pages, synthetic_pages
+
+
+def read_bulk_file(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [url.strip() for url in file if plex_poster_set_helper.is_not_comment(url.strip())]
+
+
+def local_downloads(server):
+    # Asset downloads are answered by the fake server's /images route instead of the CDNs
+    http_get = plex_poster_set_helper.http_get
+
+    def get(url, **kwargs):
+        if not url.startswith(server.url):
+            url = f"{server.url}/images/{urllib.parse.quote(url, safe='')}"
+        return http_get(url, **kwargs)
+    return get
+
+
+def write_config(server, args):
+    config = {
+        "base_url": server.url,
+        "token": server.token,
+        "tv_library": "TV Shows",
+        "movie_library": "Movies",
+        "assets_directory": "assets",
+        "max_workers": args.max_workers,
+        "max_upload_workers": args.max_upload_workers,
+        "page_cache": False,
+        "parsed_set_cache": False,
+        "state_database": "state.db",
+        "upload_mode": args.upload_mode,
+    }
+    with open("config.json", "w") as config_file:
+        json.dump(config, config_file, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a bulk file end to end against the fake Plex server and the fixture corpus.")
+    parser.add_argument("bulk_file", nargs="?", default=os.path.join(FIXTURES_DIRECTORY, "bulk_benchmark.txt"))
+    parser.add_argument("--corpus", choices=["recorded", "synthetic"], default="synthetic", help="Pages the bulk file is scraped from")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the fake server adds to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of Plex requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="Status code of injected failures")
+    parser.add_argument("--image-size", type=int, default=200, help="Size of each downloaded asset in KB")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--max-upload-workers", type=int, default=2)
+    parser.add_argument("--upload-mode", choices=plex_poster_set_helper.UPLOAD_MODES, default="file", help="upload_mode to run with")
+    parser.add_argument("--throttled", action="store_true", help="Keep the default rate limits instead of running unthrottled")
+    args = parser.parse_args()
+
+    bulk_file = os.path.abspath(args.bulk_file)
+    pages = recorded_pages() if args.corpus == "recorded" else synthetic_pages()
+    plex_poster_set_helper.fetch_page = offline_fetch_page(pages)
+    plex_poster_set_helper.page_cache = plex_poster_set_helper.parsed_set_cache = False
+
+    # Seed the fake library with an item for every poster the bulk file produces
+    with contextlib.redirect_stdout(io.StringIO()):
+        posters = plex_poster_set_helper.collect_bulk_posters(read_bulk_file(bulk_file))
+    library = library_from_posters(*posters)
+
+    server = FakePlexServer(library, token="benchmark", latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, error_status=args.error_status, image_size=args.image_size * 1024)
+    with server, tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        write_config(server, args)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            plex_poster_set_helper.plex_setup()
+        setup_time = time.perf_counter() - start
+        setup_requests = sum(server.requests.values())
+        server.reset_stats()
+
+        if not args.throttled:
+            plex_poster_set_helper.rate_limiter = plex_poster_set_helper.RateLimiter({"plex": 0, "default": 0}, start_interval=0.0)
+        plex_poster_set_helper.http_get = local_downloads(server)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            plex_poster_set_helper.parse_urls(bulk_file)
+        elapsed = time.perf_counter() - start
+
+    downloads = server.requests["GET /images/{name}"]
+    plex_requests = sum(server.requests.values()) - downloads
+    uploads = server.uploads
+    print(f"Library: {len(library.items)} items, setup {setup_time:.2f}s and {setup_requests} requests")
+    print(f"Posters scraped: {sum(len(kind) for kind in posters)}, uploads: {uploads}, downloads: {downloads}, injected errors: {server.requests['injected errors']}")
+    print(f"Run time: {elapsed:.2f}s, {uploads / elapsed:.1f} uploads/s, {downloads / elapsed:.1f} downloads/s")
+    print(f"Plex requests: {plex_requests}, {plex_requests / uploads if uploads else 0:.2f} per uploaded asset")
+    for name, count in server.requests.most_common():
+        print(f"  {count:6}  {name}")
+
+
+if __name__ == "__main__":
+    main()
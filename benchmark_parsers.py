@@ -0,0 +1,98 @@
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup, FeatureNotFound
+
+import plex_poster_set_helper
+from fixture_corpus import synthetic_pages
+
+
+BACKENDS = ["html.parser", "lxml", "html5lib"]
+
+
+def available_backends(backends):
+    available = []
+    for backend in backends:
+        try:
+            BeautifulSoup("<html></html>", backend)
+            available.append(backend)
+        except FeatureNotFound:
+            print(f"Skipping '{backend}': not installed.")
+    return available
+
+
+def measure(func, repeat):
+    func()  # Warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+
+    # Peak memory and the blocks still allocated when func returns (its result included)
+    # are measured on a separate run so tracing does not skew the timing
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+    del result
+    return elapsed, peak, blocks
+
+
+def benchmark_page(html, backends, repeat):
+    source = plex_poster_set_helper.detect_page_source(html)
+
+    rows = []
+    html_parser = plex_poster_set_helper.html_parser
+    try:
+        for backend in backends:
+            rows.append((f"parse ({backend})",) + measure(lambda: BeautifulSoup(html, backend), repeat))
+            if source == "posterdb":
+                def scrape():
+                    plex_poster_set_helper.html_parser = backend
+                    plex_poster_set_helper.scrape_posterdb(html)
+                rows.append((f"scrape_posterdb ({backend})",) + measure(scrape, repeat))
+    finally:
+        plex_poster_set_helper.html_parser = html_parser
+    if source == "mediux":
+        # MediUX pages are read by scanning the script payload, no DOM is built
+        def scan():
+            scripts = plex_poster_set_helper.mediux_data_scripts(html)
+            if scripts:
+                plex_poster_set_helper.parse_string_to_dict(scripts[-1])
+        rows.append(("script scan",) + measure(scan, repeat))
+    return rows
+
+
+def saved_pages(directory):
+    # name -> HTML of the saved pages in directory, or of the synthetic corpus when there are none
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, "r", encoding="utf-8") as file:
+            pages[os.path.basename(path)] = file.read()
+    if not pages:
+        print(f"No .html pages found in '{directory}', using the synthetic corpus.")
+        pages = synthetic_pages()
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare HTML parser backends on saved ThePosterDB and MediUX pages.")
+    parser.add_argument("fixtures", nargs="?", default="fixtures", help="Directory with saved .html pages (default: fixtures, the synthetic corpus when it has none)")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, help="BeautifulSoup backends to compare")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per measurement")
+    args = parser.parse_args()
+
+    pages = saved_pages(args.fixtures)
+    backends = available_backends(args.backends)
+    print(f"{'page':72} {'measurement':32} {'time':>10} {'peak memory':>12} {'blocks':>9}")
+    for name, html in pages.items():
+        page = f"{name} ({len(html) / 1024:.0f} KB)"
+        for label, elapsed, peak, blocks in benchmark_page(html, backends, args.repeat):
+            print(f"{page:72} {label:32} {elapsed * 1000:8.1f} ms {peak / (1024 * 1024):9.1f} MB {blocks:9}")
+
+if __name__ == "__main__":
+    main()
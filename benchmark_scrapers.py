@@ -0,0 +1,65 @@
+import argparse
+import contextlib
+import io
+
+import plex_poster_set_helper
+from benchmark_parsers import measure
+from fixture_corpus import offline_fetch_page, recorded_pages, synthetic_pages
+
+
+def count_posters(result):
+    return sum(len(posters) for posters in result) if result else 0
+
+
+def count_ids(result):
+    return sum(len(ids) for ids in result)
+
+
+def page_benchmarks(url, html):
+    # (function name, call, item counter) for every scraper that reads this kind of page
+    if "theposterdb.com" in url:
+        return [("scrape_posterdb", lambda: plex_poster_set_helper.scrape_posterdb(html), count_posters)]
+    if "/boxsets/" in url:
+        boxset_id = url.rstrip("/").split("/")[-1]
+        return [("process_boxset_url", lambda: plex_poster_set_helper.process_boxset_url(boxset_id, html), count_posters)]
+    if "/user/" in url:
+        return [("extract_ids_from_script", lambda: plex_poster_set_helper.extract_ids_from_script(html), count_ids)]
+    return [("scrape_mediux", lambda: plex_poster_set_helper.scrape_mediux(html), count_posters)]
+
+
+def run(pages, repeat):
+    # Boxset children are served from the corpus, caches are off so every run parses
+    plex_poster_set_helper.fetch_page = offline_fetch_page(pages)
+    plex_poster_set_helper.page_cache = False
+    plex_poster_set_helper.parsed_set_cache = False
+
+    rows = []
+    for url, html in pages.items():
+        for name, call, counter in page_benchmarks(url, html):
+            with contextlib.redirect_stdout(io.StringIO()):
+                items = counter(call())
+                elapsed, peak, blocks = measure(call, repeat)
+            rows.append((name, url, items, elapsed, peak, blocks))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers offline against the fixture corpus.")
+    parser.add_argument("--corpus", choices=["recorded", "synthetic"], help="Pages to run against (default: recorded pages when there are any, synthetic otherwise)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per page")
+    args = parser.parse_args()
+
+    corpus = args.corpus or ("recorded" if recorded_pages() else "synthetic")
+    pages = recorded_pages() if corpus == "recorded" else synthetic_pages()
+    if not pages:
+        print("No recorded fixtures found, record some with 'python fixture_corpus.py record' or use --corpus synthetic.")
+        return
+
+    print(f"Corpus: {corpus} ({len(pages)} pages)")
+    print(f"{'function':24} {'page':64} {'items':>6} {'time':>10} {'peak memory':>12} {'blocks':>9} {'items/s':>10}")
+    for name, url, items, elapsed, peak, blocks in run(pages, args.repeat):
+        print(f"{name:24} {url:64} {items:6} {elapsed * 1000:8.2f} ms {peak / (1024 * 1024):9.2f} MB {blocks:9} {items / elapsed:10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+import argparse
+import collections
+import hashlib
+import random
+import re
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Plex search type codes for the item types this tool touches
+TYPE_CODES = {"movie": 1, "show": 2, "season": 3, "episode": 4, "collection": 18}
+TYPE_NAMES = {str(code): name for name, code in TYPE_CODES.items()}
+
+
+class FakePlexLibrary:
+    # In-memory sections and items, enough of a Plex library for lookups, uploads and label edits
+    def __init__(self):
+        self.sections = {}
+        self.items = {}
+        self.lock = threading.Lock()
+        self._next_key = 1
+
+    def _add(self, item):
+        with self.lock:
+            rating_key = str(self._next_key)
+            self._next_key += 1
+            item.update(ratingKey=rating_key, labels=[], posters=[], arts=[], locked=set(), children=[])
+            self.items[rating_key] = item
+            if item.get("parent"):
+                self.items[item["parent"]]["children"].append(rating_key)
+            return rating_key
+
+    def add_section(self, title, section_type):
+        key = str(len(self.sections) + 1)
+        self.sections[key] = {"key": key, "title": title, "type": section_type}
+        return key
+
+    def add_show(self, section, title, year=None, guids=(), seasons=None):
+        # seasons maps season number -> number of episodes
+        folder = f"/data/tv/{title} ({year})" if year else f"/data/tv/{title}"
+        show = self._add({"type": "show", "section": section, "title": title, "year": year, "guids": list(guids), "location": folder})
+        for season_number, episode_count in sorted((seasons or {}).items()):
+            season = self._add({"type": "season", "section": section, "title": f"Season {season_number}", "index": season_number, "parent": show})
+            for episode_number in range(1, episode_count + 1):
+                self._add({"type": "episode", "section": section, "title": f"Episode {episode_number}", "index": episode_number,
+                           "parent": season, "parentIndex": season_number, "grandparent": show})
+        return show
+
+    def add_movie(self, section, title, year=None, guids=()):
+        folder = f"/data/movies/{title} ({year})" if year else f"/data/movies/{title}"
+        return self._add({"type": "movie", "section": section, "title": title, "year": year, "guids": list(guids),
+                          "file": f"{folder}/{title}.mkv"})
+
+    def add_collection(self, section, title):
+        return self._add({"type": "collection", "section": section, "title": title})
+
+    def leaves(self, rating_key):
+        item = self.items[rating_key]
+        if item["type"] == "season":
+            return list(item["children"])
+        return [episode for season in item["children"] for episode in self.items[season]["children"]]
+
+
+def library_from_posters(movieposters, showposters, collectionposters):
+    # A library holding one item for everything the posters point at, so every poster has a target
+    library = FakePlexLibrary()
+    tv_section = library.add_section("TV Shows", "show")
+    movie_section = library.add_section("Movies", "movie")
+
+    shows = {}
+    for poster in showposters:
+        seasons = shows.setdefault((poster["title"], poster.get("year"), poster.get("id")), {})
+        if isinstance(poster.get("season"), int):
+            episode = poster.get("episode") if isinstance(poster.get("episode"), int) else 0
+            seasons[poster["season"]] = max(seasons.get(poster["season"], 0), episode)
+    for (title, year, tvdb_id), seasons in shows.items():
+        library.add_show(tv_section, title, year, [f"tvdb://{tvdb_id}"] if tvdb_id else [], seasons)
+
+    movies = {(poster["title"], poster.get("year"), poster.get("id")) for poster in movieposters}
+    for title, year, tmdb_id in movies:
+        library.add_movie(movie_section, title, year, [f"tmdb://{tmdb_id}"] if tmdb_id else [])
+
+    for title in {poster["title"] for poster in collectionposters}:
+        library.add_collection(movie_section, title)
+    return library
+
+
+class FakePlexHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def handle_request(self, method):
+        fake = self.server.fake
+        parts = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parts.query, keep_blank_values=True)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        route = re.sub(r"/\d+", "/{id}", parts.path)
+        route = "/images/{name}" if route.startswith("/images/") else route
+
+        fake.delay()
+        if not route.startswith("/images/"):
+            token = self.headers.get("X-Plex-Token") or query.get("X-Plex-Token", [None])[0]
+            if fake.token and token != fake.token:
+                fake.count("unauthorized")
+                return self.send(401, b"Unauthorized", "text/plain")
+            if fake.inject_error():
+                fake.count("injected errors")
+                return self.send(fake.error_status, b"", "text/plain", {"Retry-After": "1"} if fake.error_status == 429 else None)
+        fake.count(f"{method} {route}")
+        if route == "/images/{name}":
+            return self.send_image(fake.image_for(urllib.parse.unquote(parts.path[len("/images/"):])))
+
+        try:
+            status, content = fake.route(method, parts.path, query, body)
+        except KeyError:
+            status, content = 404, None
+        except Exception:
+            status, content = 500, None
+        if isinstance(content, bytes):
+            return self.send(status, content, "image/jpeg")
+        self.send(status, ET.tostring(content, encoding="utf-8") if content is not None else b"", "text/xml;charset=utf-8")
+
+    def send_image(self, content):
+        # Images carry an ETag and Last-Modified and honour conditional and Range requests
+        fake = self.server.fake
+        etag = f'"{hashlib.sha1(content).hexdigest()[:16]}"'
+        headers = {"ETag": etag, "Last-Modified": fake.last_modified, "Accept-Ranges": "bytes"}
+        if self.headers.get("If-None-Match") == etag or (
+                "If-None-Match" not in self.headers and self.headers.get("If-Modified-Since") == fake.last_modified):
+            return fake.sent_image(self.send(304, b"", "image/jpeg", headers), 304)
+
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and (if_range is None or if_range in (etag, fake.last_modified)):
+            start = int(match.group(1))
+            if start >= len(content):
+                return fake.sent_image(self.send(416, b"", "image/jpeg", {"Content-Range": f"bytes */{len(content)}"}), 416)
+            headers["Content-Range"] = f"bytes {start}-{len(content) - 1}/{len(content)}"
+            return fake.sent_image(self.send(206, content[start:], "image/jpeg", headers), 206)
+        return fake.sent_image(self.send(200, content, "image/jpeg", headers), 200)
+
+    def send(self, status, content, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+        return len(content)
+
+
+class FakePlexServer:
+    # Local stand-in for the parts of the Plex API this tool uses, with latency and error injection.
+    # Asset downloads can be pointed at /images/<name>, which serves image_size bytes of filler
+    # unless images[name] holds other content
+    def __init__(self, library=None, host="127.0.0.1", port=0, token=None, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, image_size=200 * 1024, seed=0):
+        self.library = library or FakePlexLibrary()
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.image = bytes(image_size)
+        self.images = {}
+        self.last_modified = "Wed, 01 Jan 2025 00:00:00 GMT"
+        self.requests = collections.Counter()
+        self.image_statuses = collections.Counter()
+        self.image_bytes = 0
+        self.random = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), FakePlexHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, name):
+        with self.stats_lock:
+            self.requests[name] += 1
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.requests.clear()
+            self.image_statuses.clear()
+            self.image_bytes = 0
+
+    def image_for(self, name):
+        return self.images.get(name, self.image)
+
+    def sent_image(self, size, status):
+        with self.stats_lock:
+            self.image_statuses[status] += 1
+            self.image_bytes += size
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self.stats_lock:
+                jitter = self.random.uniform(0, self.jitter)
+            time.sleep(self.latency + jitter)
+
+    def inject_error(self):
+        if not self.error_rate:
+            return False
+        with self.stats_lock:
+            return self.random.random() < self.error_rate
+
+    @property
+    def uploads(self):
+        return sum(count for name, count in self.requests.items() if name.startswith("POST ") and name.endswith(("/posters", "/arts")))
+
+    # Routing
+
+    def route(self, method, path, query, body):
+        library = self.library
+        segments = [segment for segment in path.split("/") if segment]
+        if method == "GET" and not segments:
+            return 200, self.container(friendlyName="Fake Plex", machineIdentifier="fake-plex", version="1.40.0.0", myPlex="0")
+        if segments == ["library"]:
+            return 200, self.container(title1="Plex Library")
+        if segments == ["library", "sections"]:
+            return 200, self.container(*(
+                ET.Element("Directory", key=section["key"], type=section["type"], title=section["title"],
+                           agent="tv.plex.agents.none", scanner="Plex Scanner", language="en", uuid=f"section-{section['key']}")
+                for section in library.sections.values()))
+        if segments[:2] == ["library", "sections"] and len(segments) == 4:
+            section = library.sections[segments[2]]
+            if method == "PUT":
+                return self.edit(query)
+            if "includeMeta" in query:
+                return 200, self.meta(section, segments[3])
+            return 200, self.listing(section, segments[3], query)
+        if segments[:2] == ["library", "metadata"]:
+            item = library.items[segments[2]]
+            action = segments[3] if len(segments) > 3 else None
+            if action is None:
+                return 200, self.container(self.element(item, children="includeChildren" in query))
+            if action == "children":
+                return 200, self.container(*(self.element(library.items[key]) for key in item["children"]))
+            if action == "allLeaves":
+                return 200, self.container(*(self.element(library.items[key]) for key in library.leaves(item["ratingKey"])))
+            if action in ("posters", "arts"):
+                if method == "POST":
+                    return 200, self.upload(item, action, query, body)
+                return 200, self.container(*(ET.Element("Photo", photo) for photo in item[action]))
+        return 404, None
+
+    def container(self, *children, **attributes):
+        container = ET.Element("MediaContainer", size=str(len(children)), **attributes)
+        container.extend(children)
+        return container
+
+    def element(self, item, children=False):
+        base = {"ratingKey": item["ratingKey"], "key": f"/library/metadata/{item['ratingKey']}", "type": item["type"],
+                "title": item["title"], "librarySectionID": item["section"], "guid": f"plex://{item['type']}/{item['ratingKey']}"}
+        if item.get("year"):
+            base["year"] = str(item["year"])
+        if item.get("index") is not None:
+            base["index"] = str(item["index"])
+        if item["type"] == "season":
+            base.update(parentRatingKey=item["parent"], parentTitle=self.library.items[item["parent"]]["title"], parentIndex=base["index"])
+        if item["type"] == "episode":
+            base.update(parentRatingKey=item["parent"], parentIndex=str(item["parentIndex"]), grandparentRatingKey=item["grandparent"],
+                        grandparentTitle=self.library.items[item["grandparent"]]["title"])
+        if item["type"] == "show":
+            base["key"] += "/children"
+        if item["type"] == "collection":
+            base["subtype"] = "movie"
+
+        for selected in (photo for photo in item["posters"] if photo["selected"] == "1"):
+            base["thumb"] = selected["key"]
+        for selected in (photo for photo in item["arts"] if photo["selected"] == "1"):
+            base["art"] = selected["key"]
+
+        element = ET.Element("Video" if item["type"] in ("movie", "episode") else "Directory", base)
+        if item.get("location"):
+            ET.SubElement(element, "Location", path=item["location"])
+        if item.get("file"):
+            ET.SubElement(ET.SubElement(element, "Media"), "Part", file=item["file"])
+        for guid in item.get("guids", []):
+            ET.SubElement(element, "Guid", id=guid)
+        for label in item["labels"]:
+            ET.SubElement(element, "Label", tag=label)
+        if children and item["children"]:
+            container = ET.SubElement(element, "Children", size=str(len(item["children"])))
+            container.extend(self.element(self.library.items[key]) for key in item["children"])
+        return element
+
+    def meta(self, section, listing):
+        # The filter definitions plexapi validates search arguments against
+        container = self.container(totalSize="0")
+        meta = ET.SubElement(container, "Meta")
+        for libtype in ("collection",) if listing == "collections" else (section["type"], "collection"):
+            filtering = ET.SubElement(meta, "Type", key=f"/library/sections/{section['key']}/all?type={TYPE_CODES[libtype]}",
+                                      type=libtype, title=libtype.capitalize(), active="1")
+            ET.SubElement(filtering, "Field", key="title" if libtype == section["type"] else f"{libtype}.title", title="Title", type="string")
+            ET.SubElement(filtering, "Field", key="year" if libtype == section["type"] else f"{libtype}.year", title="Year", type="integer")
+        for field_type, operators in (("string", ("=", "!=", "==", "!==")), ("integer", ("=", "!=", ">>=", "<<="))):
+            element = ET.SubElement(meta, "FieldType", type=field_type)
+            for operator in operators:
+                ET.SubElement(element, "Operator", key=operator, title=operator)
+        return container
+
+    def listing(self, section, listing, query):
+        libtype = "collection" if listing == "collections" else TYPE_NAMES.get(query.get("type", [""])[0], section["type"])
+        items = [item for item in self.library.items.values() if item["section"] == section["key"] and item["type"] == libtype]
+
+        for name, values in query.items():
+            field = name.split(".")[-1].rstrip("!<>=")
+            value = values[0]
+            if field == "title":
+                items = [item for item in items if value.lower() in item["title"].lower()]
+            elif field == "year":
+                items = [item for item in items if str(item.get("year")) == value]
+            elif field == "guid":
+                items = [item for item in items if value in item.get("guids", [])]
+            elif field == "id":
+                items = [item for item in items if item["ratingKey"] in value.split(",")]
+
+        total = len(items)
+        start = int(query.get("X-Plex-Container-Start", [0])[0])
+        size = int(query.get("X-Plex-Container-Size", [total])[0])
+        if "limit" in query:
+            size = min(size, int(query["limit"][0]))
+        container = self.container(*(self.element(item) for item in items[start:start + size]), totalSize=str(total), offset=str(start))
+        return container
+
+    def upload(self, item, kind, query, body):
+        # Files are keyed by content like Plex does, URL uploads keep the URL
+        url = query.get("url", [None])[0]
+        rating_key = url if url else f"upload://{kind}/{hashlib.sha1(body).hexdigest()}"
+        with self.library.lock:
+            for photo in item[kind]:
+                photo["selected"] = "0"
+            item[kind] = [photo for photo in item[kind] if photo["ratingKey"] != rating_key]
+            item[kind].append({"key": f"/library/metadata/{item['ratingKey']}/file?url={urllib.parse.quote(rating_key, safe='')}",
+                               "ratingKey": rating_key, "selected": "1", "provider": "local" if not url else ""})
+        return None
+
+    def edit(self, query):
+        # Label edits replace the whole list, the same way Plex treats label[i].tag.tag
+        labels = [values[0] for name, values in sorted(query.items()) if re.fullmatch(r"label\[\d+\]\.tag\.tag", name)]
+        with self.library.lock:
+            for rating_key in query.get("id", [""])[0].split(","):
+                item = self.library.items[rating_key]
+                if labels:
+                    item["labels"] = labels
+                item["locked"].update(name[:-len(".locked")] for name, values in query.items() if name.endswith(".locked") and values[0] == "1")
+        return 200, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Plex API, seeded from the synthetic fixture corpus.")
+    parser.add_argument("--port", type=int, default=32400)
+    parser.add_argument("--token", default=None, help="Require this X-Plex-Token")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of Plex requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="Status code of injected failures")
+    args = parser.parse_args()
+
+    import fixture_corpus
+    import plex_poster_set_helper
+    results = [plex_poster_set_helper.scrape_mediux(html) if "mediux.pro" in url else plex_poster_set_helper.scrape_posterdb(html)
+               for url, html in fixture_corpus.synthetic_pages().items() if "/sets/" in url or "/set/" in url]
+    library = library_from_posters(*plex_poster_set_helper.merge_poster_results(results))
+
+    server = FakePlexServer(library, port=args.port, token=args.token, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, error_status=args.error_status)
+    print(f"Fake Plex server listening on {server.url} with {len(library.items)} items, press Ctrl+C to stop.")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import json
+import os
+import re
+import sys
+import urllib.parse
+
+import plex_poster_set_helper
+
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MANIFEST_PATH = os.path.join(FIXTURES_DIRECTORY, "manifest.json")
+
+
+def load_manifest():
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(manifest):
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4)
+        file.write("\n")
+
+
+def fixture_name(url):
+    # e.g. https://mediux.pro/sets/13427 -> mediux-set-13427, ...user/name/sets?page=2 -> mediux-user-name-page-2
+    parts = urllib.parse.urlsplit(url)
+    source = "mediux" if "mediux.pro" in parts.netloc else "posterdb"
+    path = [part for part in parts.path.split("/") if part]
+    kind = {"sets": "set", "set": "set", "boxsets": "boxset", "user": "user", "poster": "poster"}.get(path[0], path[0])
+    name = "-".join([source, kind] + [part for part in path[1:] if part != "sets"])
+    page = urllib.parse.parse_qs(parts.query).get("page")
+    if page:
+        name += f"-page-{page[0]}"
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+def recorded_pages(manifest=None):
+    # URL -> HTML for every manifest entry that has been recorded
+    manifest = manifest if manifest is not None else load_manifest()
+    pages = {}
+    for name, entry in manifest.items():
+        path = os.path.join(FIXTURES_DIRECTORY, f"{name}.html")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                pages[entry["url"]] = file.read()
+    return pages
+
+
+def offline_fetch_page(pages):
+    def fetch_page(url):
+        if url not in pages:
+            raise Exception(f"Page not in the fixture corpus: {url}")
+        return pages[url]
+    return fetch_page
+
+
+def record(urls, manifest):
+    # Saves live pages and follows boxset children and user pagination so they replay offline.
+    # Pages found that way are added without expected counts, they only serve the page that links them
+    plex_poster_set_helper.page_cache = False
+    os.makedirs(FIXTURES_DIRECTORY, exist_ok=True)
+    queue = list(urls)
+    while queue:
+        url = queue.pop(0)
+        name = fixture_name(url)
+        print(f"Recording {url} -> {name}.html")
+        try:
+            html = plex_poster_set_helper.fetch_page(url)
+        except (Exception, SystemExit) as e:
+            # fetch_page exits on error responses, one missing page should not end the recording
+            print(f"Failed to record {url}: {e}")
+            continue
+        with open(os.path.join(FIXTURES_DIRECTORY, f"{name}.html"), "w", encoding="utf-8") as file:
+            file.write(html)
+        manifest.setdefault(name, {})["url"] = url
+
+        if "mediux.pro/boxsets/" in url:
+            queue.extend(f"https://mediux.pro/sets/{set_id}" for set_id in plex_poster_set_helper.extract_boxset_set_ids(html)
+                         if fixture_name(f"https://mediux.pro/sets/{set_id}") not in manifest)
+        elif "mediux.pro" in url and "/user/" in url and "page=1" in url:
+            base_url = url.split("?")[0]
+            pages = plex_poster_set_helper.scrape_mediux_user_info(html)
+            queue.extend(f"{base_url}?page={page}" for page in range(2, pages + 1))
+    save_manifest(manifest)
+
+
+def mediux_page(payload, links=""):
+    # Next.js pages carry their data as an escaped JSON string inside a script tag
+    escaped = json.dumps(payload).replace('"', '\\"')
+    return f'<html><body>{links}<script>self.__next_f.push([1,"5:[\\"$\\",\\"$L1\\",null,{escaped}]"])</script></body></html>'
+
+
+def mediux_show_set(set_id, name, tvdb_id, first_air_date, episode_counts, backdrop=True):
+    # episode_counts maps season number -> number of title cards, every season gets a cover
+    seasons = []
+    files = [{"id": f"{set_id}-show", "show_id": {"id": tvdb_id}}]
+    if backdrop:
+        files.append({"id": f"{set_id}-backdrop", "fileType": "backdrop", "show_id_backdrop": {"id": tvdb_id}})
+    for season_number, episode_count in episode_counts.items():
+        season_id = set_id * 1000 + season_number
+        episodes = [{"id": season_id * 1000 + episode, "episode_number": episode} for episode in range(1, episode_count + 1)]
+        seasons.append({"id": season_id, "season_number": season_number, "episodes": episodes})
+        files.append({"id": f"{season_id}-cover", "season_id": {"id": season_id}})
+        files.extend({"id": f"{episode['id']}-card", "fileType": "title_card", "title": f"S{season_number:02}E{episode['episode_number']:02}",
+                      "episode_id": {"id": episode["id"], "season_id": {"season_number": season_number}}} for episode in episodes)
+    show = {"name": name, "tvdb_id": tvdb_id, "first_air_date": first_air_date, "seasons": seasons}
+    return mediux_page({"set": {"id": set_id, "files": files, "show": show}})
+
+
+def mediux_collection_set(set_id, collection_name, movies):
+    files = [{"id": f"{set_id}-collection", "collection_id": {"id": set_id}}]
+    for movie in movies:
+        files.append({"id": f"{movie['id']}-poster", "movie_id": {"id": movie["id"]}})
+        files.append({"id": f"{movie['id']}-backdrop", "movie_id_backdrop": {"id": movie["id"]}})
+    collection = {"collection_name": collection_name, "movies": movies}
+    return mediux_page({"set": {"id": set_id, "files": files, "collection": collection, "backdropCheck": [{"id": f"{set_id}-collection-backdrop"}]}})
+
+
+def mediux_boxset(boxset_id, set_ids):
+    return mediux_page({"files": [], "set": None, "boxset": {"id": boxset_id, "sets": [{"id": set_id} for set_id in set_ids]}})
+
+
+def mediux_user_page(page, pages, set_ids, boxset_ids):
+    links = "".join(f'<a href="/user/synthetic/sets?page={number}">{number}</a>' for number in range(1, pages + 1))
+    sets = [{"id": set_id, "files": []} for set_id in set_ids] + [{"id": None, "boxset": {"id": boxset_id}} for boxset_id in boxset_ids]
+    return mediux_page({"files": [], "user": {"sets": sets}}, links)
+
+
+def posterdb_page(posters):
+    # posters: (media type, title) pairs laid out like a ThePosterDB set or uploads grid
+    items = "".join(
+        f'<div class="col-6 col-lg-2 p-1"><a class="text-white" data-toggle="tooltip" data-placement="top" title="{media_type}">{media_type}</a>'
+        f'<div class="overlay" data-poster-id="{poster_id}"></div><p class="p-0 mb-1 text-break">{title}</p></div>'
+        for poster_id, (media_type, title) in enumerate(posters, start=1)
+    )
+    return f'<html><head><meta name="csrf-token" content="synthetic"></head><body><div class="row d-flex flex-wrap m-0 w-100 mx-n1 mt-n1">{items}</div></body></html>'
+
+
+# What the synthetic pages that have no recordable counterpart yield, the set pages follow the manifest counts
+SYNTHETIC_EXPECTED = {
+    "https://mediux.pro/boxsets/4001": {"movies": 6, "shows": 522, "collections": 2},
+    "https://mediux.pro/user/synthetic/sets?page=1": {"sets": 30, "boxsets": 1},
+}
+
+
+def synthetic_pages():
+    # Stand-ins shaped like the recorded pages, sized after the sets used in test_module.py
+    modern_family = {0: 0, 1: 24, 2: 24, 3: 24, 4: 24, 5: 24, 6: 24, 7: 22, 8: 22, 9: 22, 10: 22, 11: 18}
+    doctor_who = {0: 0, 1: 13, 2: 14, 3: 14, 4: 18, 5: 14, 6: 14, 7: 17, 8: 13, 9: 13, 10: 13, 11: 11, 12: 12, 13: 66}
+    dark_knight = [{"id": 272, "title": "Batman Begins", "release_date": "2005-06-10"},
+                   {"id": 155, "title": "The Dark Knight", "release_date": "2008-07-16"},
+                   {"id": 49026, "title": "The Dark Knight Rises", "release_date": "2012-07-16"}]
+    brooklyn = [("Show", "Brooklyn Nine-Nine (2013)")] + [("Show", f"Brooklyn Nine-Nine (2013) - Season {season}") for season in range(1, 9)] + [("Show", "Brooklyn Nine-Nine (2013) - Specials")]
+    uploads = [("Movie", f"Synthetic Movie {number} ({1990 + number % 30})") for number in range(24)]
+
+    pages = {
+        "https://mediux.pro/sets/13427": mediux_show_set(13427, "Modern Family", 95011, "2009-09-23", modern_family),
+        "https://mediux.pro/sets/9406": mediux_show_set(9406, "Doctor Who", 78804, "2005-03-26", doctor_who, backdrop=False),
+        "https://mediux.pro/sets/9242": mediux_show_set(9242, "Mr. & Mrs. Smith", 420693, "2024-02-02", {1: 8}),
+        "https://mediux.pro/sets/30001": mediux_collection_set(30001, "The Dark Knight Collection", dark_knight),
+        "https://mediux.pro/boxsets/4001": mediux_boxset(4001, [13427, 9406, 9242, 30001]),
+        "https://theposterdb.com/set/8846": posterdb_page(brooklyn),
+        "https://theposterdb.com/set/13035": posterdb_page([("Collection", "The Dark Knight Collection")] + [("Movie", f"{movie['title']} ({movie['release_date'][:4]})") for movie in dark_knight]),
+        "https://theposterdb.com/user/synthetic?section=uploads&page=1": posterdb_page(uploads),
+    }
+    for page in range(1, 4):
+        set_ids = [40000 + page * 100 + number for number in range(30)]
+        pages[f"https://mediux.pro/user/synthetic/sets?page={page}"] = mediux_user_page(page, 3, set_ids, [4001] if page == 1 else [])
+    return pages
+
+
+if __name__ == "__main__":
+    # python fixture_corpus.py record [URL ...] records the given URLs, or every URL in the manifest
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        manifest = load_manifest()
+        record(sys.argv[2:] or [entry["url"] for entry in manifest.values()], manifest)
+    else:
+        print("Usage: python fixture_corpus.py record [URL ...]")
@@ -1,20 +1,54 @@
+import glob
+import hashlib
 import json
 import math
 import os
 import re
+import shutil
+import sqlite3
 import stat
 import sys
+import tempfile
+import threading
 import time
+import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from plexapi.server import PlexServer
 import plexapi.exceptions
+import plexapi.video
 
 
 LABEL_RATING_KEYS = {}
+LABELLED_THIS_RUN = set()
+# Bump whenever the scrapers change their output so stored parsed sets are ignored
+PARSER_VERSION = 1
+LIBRARY_INDEX = {}
+LIBRARY_INDEX_PAGE_SIZE = 10000
+library_index_lock = threading.Lock()
+COLLECTION_CACHE = {}
+collection_cache_lock = threading.Lock()
+HTTP_SESSIONS = {}
+http_session_lock = threading.Lock()
+STATE_DB = None
+state_db_lock = threading.Lock()
+METADATA_CACHE = {}
+SHOW_TREES = {}
+METADATA_LOCKS = {}
+metadata_cache_lock = threading.Lock()
+NAMED_LOCKS = {}
+named_locks_lock = threading.Lock()
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+ASSET_STORE_DIRECTORY = ".store"
+# Left in the store once an asset file had to be copied, copies do not show up as users of their image
+ASSET_STORE_COPIES = ".copies"
+STORED_ASSETS = set()
 MEDIA_TYPES_PARENT_VALUES = {
     "movie": 1,
     "show": 2,
@@ -40,6 +74,111 @@ overwrite_labelled_shows = False
 only_process_new_assets = True
 useragent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 
+# BeautifulSoup backend: "html.parser" (built in), "lxml" or "html5lib" when installed
+html_parser = None
+
+# "file": download to the assets directory and upload the file, "url": Plex fetches the image itself,
+# "hybrid": Plex fetches the image while the asset file is written in the background,
+# "assets": only write the Kometa asset folders, nothing is uploaded or labelled
+upload_mode = None
+UPLOAD_MODES = ("file", "url", "hybrid", "assets")
+
+# Scraped pages are cached on disk, fresh for page_cache_ttl seconds and revalidated afterwards
+page_cache = True
+page_cache_directory = os.path.join(".cache", "pages")
+page_cache_ttl = 6 * 60 * 60
+page_cache_max_size = 200  # MB
+
+# Parsed sets are stored by source, set ID and a hash of the page payload they were parsed from
+parsed_set_cache = True
+parsed_set_directory = os.path.join(".cache", "sets")
+
+# Downloaded images are kept once in <assets_directory>/.store, keyed by their MediUX/ThePosterDB asset ID,
+# and linked into the asset folders; blobs no asset file uses are evicted above asset_store_max_size MB
+asset_store = True
+asset_store_max_size = None
+
+# Uploaded assets are recorded here so re-runs only process posters whose source changed
+state_database = "state.db"
+# Uploads are skipped when the item already shows the same file or source URL
+skip_identical_uploads = True
+
+# Collections are listed once per library and reused for this many seconds (None: the whole run)
+collection_cache_ttl = None
+
+# Concurrency settings
+max_workers = 8
+max_upload_workers = 2
+upload_semaphore = threading.BoundedSemaphore(max_upload_workers)
+local_parse_workers = None  # Processes parsing local HTML files (None: one per CPU)
+
+# HTTP settings, timeouts are (connect, read) seconds and only GETs are retried
+http_pool_size = 10
+http_timeout = (5, 30)
+http_retries = 3
+http_backoff = 0.5
+
+# Requests per second ceilings, "plex" is the configured Plex server
+DEFAULT_RATE_LIMITS = {"plex": 10, "theposterdb.com": 2, "mediux.pro": 5, "default": 5}
+
+
+class RateLimiter:
+    # Per-host adaptive request spacing: speeds up towards the ceiling while a host
+    # answers quickly and backs off on slow responses, 429s and 5xx errors
+    def __init__(self, rate_limits=None, start_interval=1.0, max_interval=60.0, slow_response=2.0):
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.start_interval = start_interval
+        self.max_interval = max_interval
+        self.slow_response = slow_response
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host_key(self, url):
+        host = (urllib.parse.urlsplit(url).hostname or "").lower()
+        if base_url and host == (urllib.parse.urlsplit(base_url).hostname or "").lower():
+            return "plex"
+        for name in self.rate_limits:
+            if host == name or host.endswith(f".{name}"):
+                return name
+        return host or "default"
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            ceiling = self.rate_limits.get(host, self.rate_limits.get("default"))
+            min_interval = 1.0 / ceiling if ceiling else 0.0
+            state = self.hosts[host] = {"min_interval": min_interval, "interval": max(min_interval, self.start_interval), "next": 0.0}
+        return state
+
+    def wait(self, host):
+        with self.lock:
+            state = self._state(host)
+            now = time.monotonic()
+            slot = max(now, state["next"])
+            state["next"] = slot + state["interval"]
+        if slot > now:
+            time.sleep(slot - now)
+
+    def record(self, host, elapsed, status=200, retry_after=None):
+        with self.lock:
+            state = self._state(host)
+            if status is None or status == 429 or status >= 500:
+                state["interval"] = min(self.max_interval, max(state["interval"] * 2, self.start_interval))
+                if retry_after:
+                    state["next"] = max(state["next"], time.monotonic() + retry_after)
+            elif elapsed > self.slow_response:
+                state["interval"] = min(self.max_interval, state["interval"] * 1.5)
+            else:
+                state["interval"] = max(state["min_interval"], state["interval"] * 0.75)
+
+
+rate_limiter = RateLimiter()
+
+# Background asset downloads of the hybrid upload mode
+ASSET_WRITER = None
+ASSET_WRITES = []
+asset_writer_lock = threading.Lock()
+
 # Data containers
 tv = []
 movies = []
@@ -47,7 +186,7 @@ plex_collections = []
 
 
 def plex_setup():
-    global tv, movies, plex_collections, append_label, overwrite_labelled_shows, assets_directory, overwrite_existing_assets, base_url, token, asset_folders, only_process_new_assets, useragent
+    global tv, movies, plex_collections, append_label, overwrite_labelled_shows, assets_directory, overwrite_existing_assets, base_url, token, asset_folders, only_process_new_assets, useragent, max_workers, max_upload_workers, upload_semaphore, rate_limiter, collection_cache_ttl, http_pool_size, http_timeout, http_retries, http_backoff, page_cache, page_cache_directory, page_cache_ttl, page_cache_max_size, parsed_set_cache, parsed_set_directory, state_database, html_parser, local_parse_workers, upload_mode, asset_store, asset_store_max_size, skip_identical_uploads
 
     def load_config(filename="config.json"):
         with open(filename) as f:
@@ -89,13 +228,43 @@ def plex_setup():
                 overwrite_labelled_shows = config.get("overwrite_labelled_shows", False)
             if 'only_process_new_assets' not in globals() or only_process_new_assets is None:
                 only_process_new_assets = config.get("only_process_new_assets", True)
+            if html_parser is None:
+                html_parser = config.get("html_parser", "html.parser")
+            if upload_mode is None:
+                upload_mode = config.get("upload_mode", "file")
+            if upload_mode not in UPLOAD_MODES:
+                print(f"Unknown upload_mode '{upload_mode}', using 'file'.")
+                upload_mode = "file"
 
             asset_folders = config.get("asset_folders", True)
             useragent = config.get("useragent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
-
-            plex = PlexServer(base_url, token)
+            max_workers = max(1, int(config.get("max_workers", 8)))
+            max_upload_workers = max(1, int(config.get("max_upload_workers", 2)))
+            local_parse_workers = config.get("local_parse_workers")
+            upload_semaphore = threading.BoundedSemaphore(max_upload_workers)
+            rate_limiter = RateLimiter(config.get("rate_limits"))
+            collection_cache_ttl = config.get("collection_cache_ttl")
+            http_pool_size = max(1, int(config.get("http_pool_size", 10)))
+            http_timeout = http_timeout_from_config(config.get("http_timeout", (5, 30)))
+            http_retries = int(config.get("http_retries", 3))
+            http_backoff = float(config.get("http_backoff", 0.5))
+            HTTP_SESSIONS.clear()
+            page_cache = config.get("page_cache", True)
+            page_cache_directory = config.get("page_cache_directory", os.path.join(".cache", "pages"))
+            page_cache_ttl = config.get("page_cache_ttl", 6 * 60 * 60)
+            page_cache_max_size = config.get("page_cache_max_size", 200)
+            parsed_set_cache = config.get("parsed_set_cache", True)
+            parsed_set_directory = config.get("parsed_set_directory", os.path.join(".cache", "sets"))
+            state_database = config.get("state_database", "state.db")
+            skip_identical_uploads = config.get("skip_identical_uploads", True)
+            asset_store = config.get("asset_store", True)
+            asset_store_max_size = config.get("asset_store_max_size")
+
+            plex = PlexServer(base_url, token, session=get_http_session(base_url), timeout=http_timeout[-1])
         except (FileNotFoundError, json.JSONDecodeError) as e:
             handle_plex_exception(e, "Error with config.json file")
+        except ValueError as e:
+            handle_plex_exception(e, "Invalid value in config.json")
         except requests.exceptions.RequestException as e:
             handle_plex_exception(e, 'Unable to connect to Plex server')
         except plexapi.exceptions.Unauthorized as e:
@@ -104,20 +273,40 @@ def plex_setup():
         tv = get_plex_library(plex, tv_library, "TV")
         movies = get_plex_library(plex, movie_library, "Movie")
         plex_collections = tv + movies
+        build_library_index(tv + movies)
+        if state_database:
+            open_state_database(state_database)
     else:
         handle_plex_exception(e, f"No config.json file found")
 
+def normalize_collection_title(title):
+    return title.lower().replace(' collection', '')
+
+
+def get_library_collections(lib):
+    with collection_cache_lock:
+        cached = COLLECTION_CACHE.get(lib.key)
+        if cached and (collection_cache_ttl is None or time.monotonic() - cached[0] < collection_cache_ttl):
+            return cached[1]
+
+        # Get all collections from the library, keyed by normalized title
+        collections = {}
+        for collection in lib.collections():
+            collections.setdefault(normalize_collection_title(collection.title), collection)
+
+        COLLECTION_CACHE[lib.key] = (time.monotonic(), collections)
+        return collections
+
+
 def find_collection(libraries, poster):
     collections = []
+    title = normalize_collection_title(poster['title'])
 
     for lib in libraries:
         try:
-            # Get all collections from the library
-            all_collections = lib.collections()
-            for collection in all_collections:
-                if collection.title.lower().replace(' collection', '') == poster['title'].lower().replace(' collection', ''):
-                    collections.append(collection)
-                    break  # No need to check other titles for this collection
+            collection = get_library_collections(lib).get(title)
+            if collection is not None:
+                collections.append(collection)
 
         except Exception as e:
             # Log the exception with a message
@@ -126,19 +315,187 @@ def find_collection(libraries, poster):
 
     return collections if collections else None
 
-        
-def cook_soup(url):
+
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After", "")
+    return int(value) if value.isdigit() else None
+
+
+def http_timeout_from_config(value):
+    # A single number is used for both the connect and the read timeout
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (value, value)
+    if isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(part, (int, float)) and not isinstance(part, bool) for part in value):
+        return tuple(value)
+    raise ValueError(f"http_timeout must be a number of seconds or a [connect, read] pair, not {value!r}")
+
+
+def get_http_session(url):
+    # One keep-alive session per host; the pool blocks when full, which also caps concurrent requests per host
+    host = rate_limiter.host_key(url)
+    with http_session_lock:
+        session = HTTP_SESSIONS.get(host)
+        if session is None:
+            retry = Retry(total=http_retries, backoff_factor=http_backoff, status_forcelist=(429, 502, 503, 504),
+                          allowed_methods=frozenset({"GET", "HEAD"}), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_pool_size, pool_block=True, max_retries=retry)
+            session = HTTP_SESSIONS[host] = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+
+def http_get(url, **kwargs):
+    host = rate_limiter.host_key(url)
+    kwargs.setdefault("timeout", http_timeout)
+    rate_limiter.wait(host)
+    start = time.monotonic()
+    try:
+        response = get_http_session(url).get(url, **kwargs)
+    except requests.RequestException:
+        rate_limiter.record(host, time.monotonic() - start, status=None)
+        raise
+    rate_limiter.record(host, time.monotonic() - start, response.status_code, retry_after_seconds(response))
+    return response
+
+
+def plex_error_status(exception):
+    # plexapi formats errors as "(<status>) <codename>; <url> <message>"
+    match = re.match(r"\((\d{3})\)", str(exception))
+    return int(match.group(1)) if match else None
+
+
+def upload_art(upload_target, asset_type, file_path=None, url=None):
+    # Uploads the local file, or lets Plex fetch the image from url when there is no file
+    rate_limiter.wait("plex")
+    start = time.monotonic()
+    source = {"filepath": file_path} if file_path else {"url": url}
+    try:
+        if asset_type == "background":
+            upload_target.uploadArt(**source)
+            upload_target.lockArt()
+        else:
+            upload_target.uploadPoster(**source)
+            upload_target.lockPoster()
+    except Exception as e:
+        rate_limiter.record("plex", time.monotonic() - start, plex_error_status(e))
+        raise
+    rate_limiter.record("plex", time.monotonic() - start)
+
+
+def page_cache_path(url):
+    return os.path.join(page_cache_directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+
+def read_page_cache(url):
+    if not page_cache:
+        return None
+    path = page_cache_path(url)
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            entry = json.load(file)
+        os.utime(path)  # Mark as recently used for eviction
+        return entry if entry.get("url") == url else None
+    except (OSError, ValueError):
+        return None
+
+
+def write_page_cache(url, entry):
+    if not page_cache:
+        return
+    os.makedirs(page_cache_directory, exist_ok=True)
+    # Write to a temporary file and rename it so other processes never see a partial entry
+    fd, temp_path = tempfile.mkstemp(dir=page_cache_directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(temp_path, page_cache_path(url))
+    except OSError as e:
+        print(f"Failed to write page cache for {url}: {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return
+    evict_page_cache()
+
+
+def evict_page_cache():
+    # Remove the least recently used pages until the cache fits in page_cache_max_size
+    if not page_cache_max_size:
+        return
+    entries = []
+    for entry in os.scandir(page_cache_directory):
+        try:
+            if entry.name.endswith(".json"):
+                stats = entry.stat()
+                entries.append((stats.st_mtime, stats.st_size, entry.path))
+        except FileNotFoundError:
+            continue
+
+    total_size = sum(size for _, size, _ in entries)
+    max_size = page_cache_max_size * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def fetch_page(url):
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36", "Sec-Ch-Ua-Mobile": "?0", "Sec-Ch-Ua-Platform": "Windows", }
 
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200 or (response.status_code == 500 and "mediux.pro" in url):
-        return BeautifulSoup(response.text, "html.parser")
-    
+    cached = read_page_cache(url)
+    if cached:
+        if time.time() - cached["fetched_at"] < page_cache_ttl:
+            return cached["text"]
+        # Revalidate stale pages where the site sent validators
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = http_get(url, headers=headers)
+
+    if response.status_code == 304 and cached:
+        cached["fetched_at"] = time.time()
+        write_page_cache(url, cached)
+        return cached["text"]
+
+    if response.status_code == 200:
+        write_page_cache(url, {
+            "url": url,
+            "fetched_at": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "text": response.text,
+        })
+        return response.text
+
+    if response.status_code == 500 and "mediux.pro" in url:
+        return response.text
+
     sys.exit(f"Failed to retrieve the page. Status code: {response.status_code}")
 
 
+def make_soup(html):
+    global html_parser
+    try:
+        return BeautifulSoup(html, html_parser or "html.parser")
+    except FeatureNotFound:
+        print(f"HTML parser '{html_parser}' is not installed, falling back to html.parser.")
+        html_parser = "html.parser"
+        return BeautifulSoup(html, "html.parser")
+
+
+def cook_soup(url):
+    return make_soup(fetch_page(url))
+
+
 def get_asset_file_path(assets_dir, folder_name, file_name):
     return os.path.join(assets_dir, folder_name, file_name)
 
@@ -152,6 +509,146 @@ def ensure_directory(directory_path):
             print(f"Failed to create directory: {e}")
 
 
+def content_range_start(response):
+    match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+def download_size(response, offset):
+    # Full size of the image, from Content-Range for resumed downloads
+    if response.status_code == 206:
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length", "")
+    return int(length) if length.isdigit() else None
+
+
+def download_file(file_url, file_path):
+    # Several posters can target the same file, their downloads take turns
+    with named_lock(f"download/{os.path.normpath(file_path)}"):
+        return download_to_path(file_url, file_path)
+
+
+def download_to_path(file_url, file_path):
+    # An existing file is only transferred again when the validators recorded for it say it changed,
+    # an interrupted download resumes from its .part file, and the finished file is renamed over file_path.
+    # Data is written to a temporary file of its own; .part only holds a download that can be resumed
+    headers = {"User-Agent": useragent, "Accept-Encoding": "identity"}
+    part_path = f"{file_path}.part"
+    known = download_record(file_path, file_url) if os.path.exists(file_path) else None
+    if known:
+        if known["etag"]:
+            headers["If-None-Match"] = known["etag"]
+        if known["last_modified"]:
+            headers["If-Modified-Since"] = known["last_modified"]
+
+    partial = download_record(part_path, file_url) if os.path.exists(part_path) else None
+    offset = os.path.getsize(part_path) if partial else 0
+    # If-Range needs a strong ETag, otherwise the date is used; without either the download starts over
+    validator = partial and (partial["etag"] if partial["etag"] and not partial["etag"].startswith("W/") else partial["last_modified"])
+    if offset and validator:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+    else:
+        offset = 0
+
+    temp_path = None
+    response = None
+    try:
+        with http_get(file_url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                return file_path
+            if response.status_code == 416:
+                forget_download(part_path)  # The partial file no longer fits the image, start over next time
+            response.raise_for_status()
+            size = download_size(response, offset)
+            # Without validators an unchanged size is taken as an unchanged image, the body is never read
+            if known and not (known["etag"] or known["last_modified"]) and response.status_code == 200 \
+                    and size is not None and size == known["content_length"] == os.path.getsize(file_path):
+                return file_path
+
+            if response.status_code != 206 or content_range_start(response) != offset:
+                offset = 0
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", prefix=f"{os.path.basename(file_path)}.", suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                if offset:
+                    with open(part_path, "rb") as part:
+                        shutil.copyfileobj(part, file, DOWNLOAD_CHUNK_SIZE)
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+
+        if size is not None and os.path.getsize(temp_path) != size:
+            raise IOError(f"incomplete download, {os.path.getsize(temp_path)} of {size} bytes")
+        os.replace(temp_path, file_path)
+        record_download(file_path, file_url, response, size, part_path)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        
+        #print(f"File downloaded and saved to: {file_path}")
+        return file_path
+    except requests.RequestException as e:
+        print(f"Failed to download file. Error: {e}")
+    except IOError as e:
+        print(f"Failed to save file to assets directory. Error: {e}")
+
+    # What arrived is kept as the .part file when the image has validators to resume it with
+    if temp_path and os.path.exists(temp_path):
+        if response is not None and (response.headers.get("ETag") or response.headers.get("Last-Modified")) and os.path.getsize(temp_path):
+            os.replace(temp_path, part_path)
+            record_download(part_path, file_url, response, size)
+        else:
+            os.remove(temp_path)
+    elif os.path.exists(part_path) and not download_record(part_path, file_url):
+        os.remove(part_path)
+    return None
+
+
+def asset_store_name(file_url):
+    # MediUX and ThePosterDB serve every asset under a stable ID, other URLs are keyed by their hash
+    parts = urllib.parse.urlsplit(file_url)
+    asset_id = None
+    if "mediux.pro" in parts.netloc:
+        source = "mediux"
+        asset_id = urllib.parse.parse_qs(parts.query).get("url", [parts.path])[0].rstrip("/").split("/")[-1]
+    elif "theposterdb.com" in parts.netloc and "/api/assets/" in parts.path:
+        source = "posterdb"
+        asset_id = parts.path.rstrip("/").split("/")[-1]
+    if not asset_id:
+        source, asset_id = "url", hashlib.sha256(file_url.encode("utf-8")).hexdigest()
+    asset_id = re.sub(r"[^\w.-]", "_", asset_id)
+    return f"{source}-{asset_id}.jpg"
+
+
+def store_asset(assets_dir, file_url):
+    # Downloads the image into the store unless it is already there (once per run when overwriting)
+    store_path = os.path.join(assets_dir, ASSET_STORE_DIRECTORY, asset_store_name(file_url))
+    with named_lock(f"store/{store_path}"):
+        if os.path.exists(store_path) and (not overwrite_existing_assets or store_path in STORED_ASSETS):
+            os.utime(store_path)  # Mark as recently used for eviction
+            return store_path
+
+        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+        if download_file(file_url, store_path) is None:
+            return None
+        STORED_ASSETS.add(store_path)
+        return store_path
+
+
+def link_asset(store_path, file_path):
+    # Hard link, a relative symlink where hard links are not possible, or a copy as a last resort.
+    # The link is made next to the asset file and renamed over it so readers never see it missing
+    temp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    try:
+        os.link(store_path, temp_path)
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(store_path, os.path.dirname(file_path)), temp_path)
+        except (OSError, NotImplementedError):
+            shutil.copyfile(store_path, temp_path)
+            open(os.path.join(os.path.dirname(store_path), ASSET_STORE_COPIES), "a").close()
+    os.replace(temp_path, file_path)
+
+
 def save_to_assets_directory(assets_dir, plex_folder, file_name, file_url):
     file_path = get_asset_file_path(assets_dir, plex_folder, file_name)
 
@@ -166,24 +663,100 @@ def save_to_assets_directory(assets_dir, plex_folder, file_name, file_url):
     plex_folder_path = os.path.dirname(file_path)
     os.makedirs(plex_folder_path, exist_ok=True)
 
-     # Download and save the file
-    headers = {"User-Agent": useragent}
-    try:
-        response = requests.get(file_url, headers=headers, stream=True)
-        response.raise_for_status()
-        
-        with open(file_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        
-        #print(f"File downloaded and saved to: {file_path}")
-        return file_path
-    except requests.RequestException as e:
-        print(f"Failed to download file. Error: {e}")
+    if not asset_store:
+        return download_file(file_url, file_path)
+
+    store_path = store_asset(assets_dir, file_url)
+    if store_path is None:
         return None
-    except IOError as e:
+    try:
+        link_asset(store_path, file_path)
+    except OSError as e:
         print(f"Failed to save file to assets directory. Error: {e}")
         return None
+    return file_path
+
+
+def asset_store_usage(assets_dir):
+    # (path, size, last used, asset files linked to it) for every image in the store
+    store_directory = os.path.join(assets_dir, ASSET_STORE_DIRECTORY)
+    if not os.path.isdir(store_directory):
+        return []
+
+    symlinks = {}
+    for root, directories, files in os.walk(assets_dir):
+        directories[:] = [name for name in directories if name != ASSET_STORE_DIRECTORY]
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                target = os.path.realpath(path)
+                symlinks[target] = symlinks.get(target, 0) + 1
+
+    blobs = []
+    for entry in os.scandir(store_directory):
+        if entry.name.startswith(".") or entry.name.endswith(".part") or not entry.is_file(follow_symlinks=False):
+            continue
+        try:
+            stats = os.stat(entry.path)  # DirEntry.stat() has no link count on Windows
+        except FileNotFoundError:
+            continue
+        links = stats.st_nlink - 1 + symlinks.get(os.path.realpath(entry.path), 0)
+        blobs.append((entry.path, stats.st_size, stats.st_mtime, links))
+    return blobs
+
+
+def report_asset_store(assets_dir):
+    # Prints how much the store holds and saves, then evicts unused images down to asset_store_max_size.
+    # Walks the whole assets directory, so it runs once at the end of a command
+    if not asset_store:
+        return
+    blobs = asset_store_usage(assets_dir)
+    if not blobs:
+        return
+    total_size = sum(size for _, size, _, _ in blobs)
+    saved_size = sum(size * max(links - 1, 0) for _, size, _, links in blobs)
+    print(f"Asset store: {len(blobs)} images, {total_size / (1024 * 1024):.1f} MB, "
+          f"{sum(links for *_, links in blobs)} asset files, {saved_size / (1024 * 1024):.1f} MB saved by links.")
+
+    if asset_store_max_size is None:
+        return
+    if os.path.exists(os.path.join(assets_dir, ASSET_STORE_DIRECTORY, ASSET_STORE_COPIES)):
+        print("Asset store: asset files are copies on this filesystem, unused images cannot be told apart and are kept.")
+        return
+    max_size = asset_store_max_size * 1024 * 1024
+    unused = sorted((last_used, size, path) for path, size, last_used, links in blobs if links == 0)
+    evicted = 0
+    for _, size, path in unused:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+            evicted += 1
+        except FileNotFoundError:
+            pass
+        total_size -= size
+    if evicted:
+        print(f"Asset store: evicted {evicted} unused images, {total_size / (1024 * 1024):.1f} MB left.")
+
+
+def save_in_background(assets_dir, plex_folder, file_name, file_url):
+    global ASSET_WRITER
+    with asset_writer_lock:
+        if ASSET_WRITER is None:
+            ASSET_WRITER = ThreadPoolExecutor(max_workers=max_workers)
+        ASSET_WRITES.append(ASSET_WRITER.submit(save_to_assets_directory, assets_dir, plex_folder, file_name, file_url))
+
+
+def flush_asset_writes():
+    # Waits for the asset files the hybrid upload mode writes in the background
+    with asset_writer_lock:
+        writes = list(ASSET_WRITES)
+        ASSET_WRITES.clear()
+    for write in writes:
+        try:
+            write.result()
+        except Exception as e:
+            print(f"Failed to write asset in the background. Error: {e}")
 
 
 def title_cleaner(string):
@@ -209,86 +782,248 @@ def parse_string_to_dict(input_string):
     return json.loads(json_data)
 
 
+SCRIPT_PATTERN = re.compile(r"<script[^>]*>(.*?)</script>", re.DOTALL | re.IGNORECASE)
+
+
+def mediux_data_scripts(page):
+    # Texts of the Next.js scripts that carry MediUX set data. Raw HTML is scanned
+    # directly, so no BeautifulSoup tree is built for it
+    if isinstance(page, str):
+        scripts = (match.group(1) for match in SCRIPT_PATTERN.finditer(page))
+    else:
+        scripts = (script.text for script in page.find_all("script"))
+    return [script for script in scripts if "files" in script and "set" in script and "Set Link\\" not in script]
+
+
 def add_label_rating_key(library_item):
-    # Retrieve existing labels for the item
-    existing_labels = [label.tag for label in library_item.labels]
+    with metadata_lock(library_item.ratingKey):
+        # Retrieve existing labels for the item
+        try:
+            metadata = get_plex_metadata(library_item.ratingKey)
+        except Exception:
+            metadata = {"labels": [label.tag for label in library_item.labels]}
+        existing_labels = metadata["labels"]
+
+        # Add new labels that do not already exist
+        new_labels = [label for label in append_label if label not in existing_labels]
+
+        if new_labels:
+            try:
+                # Plex replaces the whole label list, so send the existing labels along with the new ones
+                labels = existing_labels + new_labels
+                edits = {f"label[{i}].tag.tag": label for i, label in enumerate(labels)}
+                edits["label.locked"] = 1
+                # Recorded before the cached labels change, so other threads never see our label as an earlier run's
+                LABELLED_THIS_RUN.add(str(library_item.ratingKey))
+                library_item.edit(**edits)
+                # Update the cached labels instead of reloading the item
+                metadata["labels"] = labels
+                #print(f"Labels {new_labels} added to item '{library_item.title}'.")
+            except Exception as e:
+                print(f"Error adding labels to item '{library_item.title}': {e}")
+
 
-    # Add new labels that do not already exist
-    new_labels = [label for label in append_label if label not in existing_labels]
+def metadata_lock(rating_key):
+    with metadata_cache_lock:
+        return METADATA_LOCKS.setdefault(str(rating_key), threading.RLock())
+
+
+def named_lock(key):
+    # One lock per key for work that is not Plex metadata, e.g. a show's tree or a file in the asset store
+    with named_locks_lock:
+        return NAMED_LOCKS.setdefault(key, threading.RLock())
+
+
+def get_plex_metadata(rating_key):
+    # Fetches /library/metadata/<ratingKey> once per run and keeps the parts we use
+    rating_key = str(rating_key)
+    with metadata_lock(rating_key):
+        if rating_key in METADATA_CACHE:
+            return METADATA_CACHE[rating_key]
+
+        headers = {"X-Plex-Token": token}
+        response = http_get(f"{base_url}/library/metadata/{rating_key}?includeChildren=1", headers=headers)
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to get metadata: {response.status_code}")
 
-    if new_labels:
         try:
-            # Add each new label individually
-            for label in new_labels:
-                library_item.addLabel(label)
-            library_item.reload()  # Refresh the item's data after editing
-            #print(f"Labels {new_labels} added to item '{library_item.title}'.")
+            root = ET.fromstring(response.content)
+        except ET.ParseError as e:
+            raise Exception(f"Failed to parse XML: {e}")
+
+        item = root[0] if len(root) else root
+        try:
+            path, path_error = folder_name_from_xml(item), None
         except Exception as e:
-            print(f"Error adding labels to item '{library_item.title}': {e}")
+            path, path_error = None, str(e)
+
+        children = item.find("Children")
+        metadata = {
+            "rating_key": rating_key,
+            "path": path,
+            "path_error": path_error,
+            "labels": [label.get("tag").strip() for label in item.findall("Label") if label.get("tag")],
+            "guids": [guid.get("id") for guid in item.findall("Guid") if guid.get("id")],
+            "children": [
+                {"rating_key": child.get("ratingKey"), "type": child.get("type"), "index": child.get("index"), "title": child.get("title"), "element": child}
+                for child in (children if children is not None else [])
+            ],
+        }
+        METADATA_CACHE[rating_key] = metadata
+        return metadata
+
+
+def folder_name_from_xml(element):
+    # Shows list their folder as a Location, movies only list the files of their Parts
+    location_element = element.find(".//Location")
+
+    if location_element is not None:
+        file_path = location_element.get("path")
+
+        if not file_path:
+            raise Exception("Path attribute not found in Location element")
+
+        return os.path.basename(file_path)
+    else:
+        location_element = element.find(".//Part")
+
+        if location_element is None:
+            raise Exception("Location element not found in XML")
+
+        file_path = location_element.get("file")
+
+        if not file_path:
+            raise Exception("File attribute not found in Part element")
+
+        return os.path.basename(os.path.dirname(file_path))
 
 
 def get_file_path_from_plex(rating_key):
-    headers = {"X-Plex-Token": token}
-    response = requests.get(f"{base_url}/library/metadata/{rating_key}", headers=headers)
+    metadata = get_plex_metadata(rating_key)
+    if metadata["path"] is None:
+        raise Exception(metadata["path_error"])
+    return metadata["path"]
 
-    if response.status_code != 200:
-        raise Exception(f"Failed to get metadata: {response.status_code}")
 
-    # Parse the XML response
-    try:
-        root = ET.fromstring(response.text)
-        location_element = root.find(".//Location")
+def normalize_title(title):
+    return re.sub(r"\s+", " ", str(title or "")).strip().lower()
 
-        if location_element is not None:
-            file_path = location_element.get("path")
 
-            if not file_path:
-                raise Exception("Path attribute not found in Location element")
+def index_library_item(index, item, folder_name=None):
+    if folder_name is None:
+        try:
+            # Read the folder from the listing XML so the item does not reload itself
+            folder_name = folder_name_from_xml(item._data)
+        except Exception:
+            folder_name = None
+
+    entry = (item, folder_name)
+    for guid in item._data.findall("Guid"):
+        if guid.get("id"):
+            index["guids"].setdefault(guid.get("id"), entry)
+    title = normalize_title(item.title)
+    year = item._data.get("year")
+    index["titles"].setdefault((title, int(year) if year and year.isdigit() else None), entry)
+    index["titles"].setdefault((title, None), entry)
+
+
+def refresh_library_index(libraries=None):
+    # Rebuilds the index for the given libraries (all indexed libraries by default),
+    # used by the interactive 'refresh' command when items were renamed or rematched in Plex
+    libraries = libraries if libraries is not None else [index["library"] for index in LIBRARY_INDEX.values()]
+    build_library_index(libraries)
+    reset_library_caches()
+
+
+def reset_library_caches():
+    # Called before every command so items added to Plex since the last one are found:
+    # remembered misses are asked again and show trees and collections are reloaded
+    with library_index_lock:
+        for index in LIBRARY_INDEX.values():
+            index["misses"].clear()
+    with collection_cache_lock:
+        COLLECTION_CACHE.clear()
+    SHOW_TREES.clear()
+
+
+def build_library_index(libraries):
+    for lib in libraries:
+        index = {"library": lib, "guids": {}, "titles": {}, "misses": set()}
+        try:
+            # One bulk listing per section, GUIDs are included in the same response
+            for item in lib.search(includeGuids=True, container_size=LIBRARY_INDEX_PAGE_SIZE):
+                index_library_item(index, item)
+        except Exception as e:
+            print(f"Error indexing library '{lib.title}': {e}")
+            continue
 
-            return os.path.basename(file_path)
-        else:
-            location_element = root.find(".//Part")
+        with library_index_lock:
+            LIBRARY_INDEX[lib.key] = index
 
-            if location_element is None:
-                raise Exception("Location element not found in XML")
 
-            file_path = location_element.get("file")
+def lookup_library_index(lib, guid, poster):
+    index = LIBRARY_INDEX.get(lib.key)
+    if index is None:
+        return None, False
 
-            if not file_path:
-                raise Exception("File attribute not found in Part element")
+    if guid and guid in index["guids"]:
+        return index["guids"][guid], True
 
-            return os.path.basename(os.path.dirname(file_path))
+    year = poster.get("year")
+    title_key = (normalize_title(poster.get("title")), int(year) if year else None)
+    if title_key in index["titles"]:
+        return index["titles"][title_key], True
 
-    except ET.ParseError as e:
-        raise Exception(f"Failed to parse XML: {e}")
+    return None, (guid, title_key) in index["misses"]
 
 
 def find_in_library(libraries, poster):
-    media_type_map = {'Show': 'tvdb', 'Movies': 'tmdb'}
+    media_type_map = {'Show': 'tvdb', 'Movie': 'tmdb', 'Movies': 'tmdb'}
 
     for lib in libraries:
         try:
             library_items = []
+            guid = None
 
             # Check if the source is 'mediux' and required fields are present
             if poster.get("source") == "mediux" and all(poster.get(key) for key in ["media_type", "id"]):
                 # Determine GUID prefix based on media type
                 guid_prefix = media_type_map.get(poster["media_type"])
                 if guid_prefix:
-                    library_items = lib.search(guid=f"{guid_prefix}://{poster['id']}")
+                    guid = f"{guid_prefix}://{poster['id']}"
+
+            # Answer from the library index built in plex_setup when possible
+            entry, known_miss = lookup_library_index(lib, guid, poster)
+            if entry:
+                library_item, show_path = entry
+                if show_path is None:
+                    show_path = get_file_path_from_plex(library_item.ratingKey)
+                return library_item, show_path
+            if known_miss:
+                continue
+
+            if guid:
+                library_items = lib.search(guid=guid)
 
             # If items are found, return the first match
             if library_items:
                 library_item = library_items[0]
                 show_path = get_file_path_from_plex(library_item.ratingKey)
+                remember_library_item(lib, library_item, show_path)
                 return library_item, show_path
 
             # Fallback to searching by title and year if ID search is not available or fails
             kwargs = {'year': poster.get("year")} if poster.get("year") else {}
-            library_item = lib.get(poster["title"], **kwargs)
+            try:
+                library_item = lib.get(poster["title"], **kwargs)
+            except plexapi.exceptions.NotFound:
+                remember_library_miss(lib, guid, poster)
+                raise
 
             if library_item:
                 show_path = get_file_path_from_plex(library_item.ratingKey)
+                remember_library_item(lib, library_item, show_path)
                 return library_item, show_path
 
         except Exception as e:
@@ -299,29 +1034,117 @@ def find_in_library(libraries, poster):
     return None, None
 
 
-def check_label_for_item(rating_key):
-    headers = {"X-Plex-Token": token}
-    url = f"{base_url}/library/metadata/{rating_key}"
+def remember_library_item(lib, item, folder_name):
+    index = LIBRARY_INDEX.get(lib.key)
+    if index is not None:
+        with library_index_lock:
+            index_library_item(index, item, folder_name)
 
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
 
-        # Extract labels
-        labels = {label.get("tag").strip() for label in root.findall(".//Label") if label.get("tag")}
+def remember_library_miss(lib, guid, poster):
+    index = LIBRARY_INDEX.get(lib.key)
+    if index is not None:
+        year = poster.get("year")
+        with library_index_lock:
+            index["misses"].add((guid, (normalize_title(poster.get("title")), int(year) if year else None)))
+
+
+def labelled_by_earlier_run(rating_key):
+    # Items this run labelled still get the rest of their posters, however the uploads are scheduled
+    return str(rating_key) not in LABELLED_THIS_RUN and check_label_for_item(rating_key)
+
+
+def check_label_for_item(rating_key):
+    try:
+        labels = get_plex_metadata(rating_key)["labels"]
 
         # Check if any of the labels in append_label exist in the labels
         return any(label in labels for label in append_label)
 
-    except requests.RequestException as e:
+    except Exception as e:
         print(f"Error checking label for item with rating key {rating_key}: {e}")
-    except ET.ParseError as e:
-        print(f"Failed to parse XML response for rating key {rating_key}: {e}")
 
     return False
 
 
+def xml_int(value):
+    return int(value) if value and value.lstrip("-").isdigit() else None
+
+
+def show_seasons(tv_show):
+    # Seasons come with the show's cached metadata (includeChildren), Plex is only asked again without it
+    try:
+        children = get_plex_metadata(tv_show.ratingKey)["children"]
+    except Exception:
+        return tv_show.seasons()
+    initpath = f"/library/metadata/{tv_show.ratingKey}/children"
+    return [plexapi.video.Season(tv_show._server, child["element"], initpath, parent=tv_show)
+            for child in children if child["type"] == "season"]
+
+
+def get_show_tree(tv_show):
+    # Seasons and all episodes of a show are looked up the first time it is touched, episodes in one allLeaves call
+    with named_lock(f"tree/{tv_show.ratingKey}"):
+        tree = SHOW_TREES.get(tv_show.ratingKey)
+        if tree is None:
+            seasons = {}
+            for season in show_seasons(tv_show):
+                seasons.setdefault(xml_int(season._data.get("index")), season)
+            episodes = {}
+            for episode in tv_show.episodes():
+                episodes.setdefault((xml_int(episode._data.get("parentIndex")), xml_int(episode._data.get("index"))), episode)
+            tree = SHOW_TREES[tv_show.ratingKey] = {"seasons": seasons, "episodes": episodes}
+        return tree
+
+
+def find_season(tv_show, season_number):
+    return get_show_tree(tv_show)["seasons"][int(season_number)]
+
+
+def find_episode(tv_show, season_number, episode_number):
+    return get_show_tree(tv_show)["episodes"][(int(season_number), int(episode_number))]
+
+
+def save_asset(asset_path, file_name, file_path, poster):
+    # Assets mode: Kometa applies the artwork, so only the asset file is written
+    if os.path.exists(file_path) and not overwrite_existing_assets:
+        return
+    if save_to_assets_directory(assets_directory, asset_path, file_name, poster["url"]):
+        print(f"Saved {file_path} for {poster['title']}.")
+
+
+def art_unchanged(upload_target, labelled_item, asset_type, file_path, url):
+    # True when the target already shows this image. The last upload recorded for the target and slot is
+    # compared by file hash (or source URL when Plex fetched it); without a record, items labelled before
+    # this run are checked against the poster or background Plex has selected
+    if not skip_identical_uploads:
+        return False
+    recorded = last_upload(upload_target.ratingKey, asset_type)
+    if recorded:
+        source_url, asset_hash = recorded
+        if file_path and asset_hash:
+            return asset_hash == file_hash(file_path)
+        return source_url == url
+    if not labelled_by_earlier_run(labelled_item.ratingKey):
+        return False
+
+    rate_limiter.wait("plex")
+    start = time.monotonic()
+    try:
+        photos = upload_target.arts() if asset_type == "background" else upload_target.posters()
+    except Exception as e:
+        rate_limiter.record("plex", time.monotonic() - start, plex_error_status(e))
+        return False
+    rate_limiter.record("plex", time.monotonic() - start)
+    selected = next((photo for photo in photos if photo.selected), None)
+    if selected is None:
+        return False
+    if file_path:
+        # Plex keys uploaded files as upload://<kind>/<sha1 of the file>
+        return selected.ratingKey.startswith("upload://") and selected.ratingKey.rsplit("/", 1)[-1] == file_hash(file_path, hashlib.sha1)
+    return selected.ratingKey == url
+
+
 def upload_tv_poster(poster, tv):
     tv_show, show_path = find_in_library(tv, poster)
     
@@ -329,7 +1152,7 @@ def upload_tv_poster(poster, tv):
         print(f"{poster['title']} not found in TV libraries or failed to load path.")
         return
     
-    if check_label_for_item(tv_show.ratingKey) and not overwrite_labelled_shows:
+    if upload_mode != "assets" and labelled_by_earlier_run(tv_show.ratingKey) and not overwrite_labelled_shows:
         #print(f"Skipping upload for {poster['title']} as it already has the label '{append_label}'.")
         return
     
@@ -354,11 +1177,19 @@ def upload_tv_poster(poster, tv):
     
     file_path = get_asset_file_path(assets_directory, asset_path, file_name)
     # Handle existing file scenarios
-    if os.path.exists(file_path) and not overwrite_existing_assets:
+    if upload_mode == "assets":
+        save_asset(asset_path, file_name, file_path, poster)
+        return
+    elif upload_mode == "url":
+        file_path = None
+    elif os.path.exists(file_path) and not overwrite_existing_assets:
         if only_process_new_assets:
             #print(f"Skipping upload for {poster['title']} as only processing new assets.")
             return
         #print(f"Using existing file for upload to {poster['title']}.")
+    elif upload_mode == "hybrid":
+        save_in_background(assets_directory, asset_path, file_name, poster["url"])
+        file_path = None
     else:
         file_path = save_to_assets_directory(assets_directory, asset_path, file_name, poster["url"])
         if file_path is None:
@@ -370,22 +1201,22 @@ def upload_tv_poster(poster, tv):
             print(f"Uploading art for {poster['title']} - {poster['season']}.")
         elif poster["season"] == 0:
             try:
-                upload_target = tv_show.season("Specials")
+                upload_target = find_season(tv_show, 0)
                 print(f"Uploading art for {poster['title']} - Specials.")
                 if poster["episode"] not in {"Cover", None}:
-                    upload_target = upload_target.episode(poster["episode"])
+                    upload_target = find_episode(tv_show, 0, poster["episode"])
                     print(f"Uploading art for {poster['title']} - Specials Episode {poster['episode']}.")
             except Exception:
                 #print(f"Episode {poster['episode']} not found in Season {poster['season']} for {poster['title']}. Skipping upload.")
                 return 
         elif poster["season"] >= 1:
             try:
-                season = tv_show.season(poster["season"])
+                season = find_season(tv_show, poster["season"])
                 if poster["episode"] in {"Cover", None}:
                     upload_target = season
                     print(f"Uploading art for {poster['title']} - Season {poster['season']}.")
                 else:
-                    upload_target = season.episode(poster["episode"])
+                    upload_target = find_episode(tv_show, poster["season"], poster["episode"])
                     print(f"Uploading art for {poster['title']} - Season {poster['season']} Episode {poster['episode']}.")
             except Exception:
                 #print(f"Episode {poster['episode']} not found in Season {poster['season']} for {poster['title']}. Skipping upload.")
@@ -394,26 +1225,31 @@ def upload_tv_poster(poster, tv):
             print(f"Skipping upload for {poster['url']} due to sorting error.")
             return
 
-        # Upload art
-        try:
-            if poster["season"] == "Backdrop":
-                upload_target.uploadArt(filepath=file_path)
-                upload_target.lockArt()
-            else:
-                upload_target.uploadPoster(filepath=file_path)
-                upload_target.lockPoster()
-        except Exception as e:
-            print(f"Unable to upload art for {poster['title']}. Error: {e}")
+        asset_type = "background" if poster["season"] == "Backdrop" else "poster"
+        if art_unchanged(upload_target, tv_show, asset_type, file_path, poster["url"]):
+            print(f"Skipping upload for {poster['title']}, Plex already has this {asset_type}.")
             return
-        
-        # Add labels and delay
-        add_label_rating_key(tv_show)
-        time.sleep(6)
+
+        with upload_semaphore:
+            # Upload art
+            try:
+                upload_art(upload_target, asset_type, file_path, poster["url"])
+            except Exception as e:
+                print(f"Unable to upload art for {poster['title']}. Error: {e}")
+                return
+
+            # Add labels
+            add_label_rating_key(tv_show)
+            record_upload(asset_slot(poster, "show"), upload_target.ratingKey, poster["url"], file_path, asset_type)
     except Exception as e:
         print(f"Error uploading {poster['title']} - {e}")
 
 
 
+def get_asset_type(poster):
+    return "poster" if poster.get("source") == "posterdb" else {"poster": "poster", "background": "background", "backdrop": "background"}.get(poster.get("file_type"), "poster")
+
+
 def upload_movie_poster(poster, movies):
     movies, show_path = find_in_library(movies, poster)
     if not movies or not show_path:
@@ -421,12 +1257,12 @@ def upload_movie_poster(poster, movies):
         return
         
     for movie in movies:
-        if check_label_for_item(movie.ratingKey) and not overwrite_labelled_shows:
+        if upload_mode != "assets" and labelled_by_earlier_run(movie.ratingKey) and not overwrite_labelled_shows:
             #print(f"Skipping upload for {poster['title']} as it already has the label '{append_label}'.")
             break
         
         # Determine asset type
-        asset_type = "poster" if poster.get("source") == "posterdb" else {"poster": "poster", "background": "background", "backdrop": "background"}.get(poster.get("file_type"), "poster")
+        asset_type = get_asset_type(poster)
 
         if asset_type in {"poster", "background"}:
             asset_path = f"movies/{show_path}" if asset_folders else f"movies"
@@ -438,11 +1274,19 @@ def upload_movie_poster(poster, movies):
     
         file_path = get_asset_file_path(assets_directory, asset_path, file_name)
         
-        if os.path.exists(file_path) and not overwrite_existing_assets:
+        if upload_mode == "assets":
+            save_asset(asset_path, file_name, file_path, poster)
+            break
+        elif upload_mode == "url":
+            file_path = None
+        elif os.path.exists(file_path) and not overwrite_existing_assets:
             if only_process_new_assets:
                 #print(f"Skipping upload for {poster['title']} as the {asset_type} already exists.")
                 break
             #print(f"Using existing file for upload to {poster['title']}.")
+        elif upload_mode == "hybrid":
+            save_in_background(assets_directory, asset_path, file_name, poster["url"])
+            file_path = None
         else:
             file_path = save_to_assets_directory(assets_directory, asset_path, file_name, poster["url"])
             if not file_path:
@@ -450,21 +1294,16 @@ def upload_movie_poster(poster, movies):
                 break
                 
         try:
-            if asset_type == 'poster':
-                movie.uploadPoster(filepath=file_path)
-                movie.lockPoster()
-            elif asset_type == 'background':
-                movie.uploadArt(filepath=file_path)
-                movie.lockArt()
-            else:
-                print(f"Unknown asset type '{asset_type}' for {poster['title']}.")
-                break
-            print(f'Uploaded {asset_type} for {poster["title"]}.')
-                
-            # Add labels to the collection item after upload
-            add_label_rating_key(movie)
-                
-            time.sleep(6)  # Timeout to prevent spamming servers
+            if art_unchanged(movie, movie, asset_type, file_path, poster["url"]):
+                print(f'Skipping upload for {poster["title"]}, Plex already has this {asset_type}.')
+                continue
+            with upload_semaphore:
+                upload_art(movie, asset_type, file_path, poster["url"])
+                print(f'Uploaded {asset_type} for {poster["title"]}.')
+
+                # Add labels to the collection item after upload
+                add_label_rating_key(movie)
+                record_upload(asset_slot(poster, "movie"), movie.ratingKey, poster["url"], file_path, asset_type)
         except Exception as e:
             print(f'Unable to upload {asset_type} for {poster["title"]}. Error: {e}')
             break
@@ -480,15 +1319,15 @@ def upload_collection_poster(poster, plex_collections):
 
     item_found = False
     for item in collection_items:
-        if item.title.lower().replace(' collection', '') == poster['title'].lower().replace(' collection', ''):
+        if normalize_collection_title(item.title) == normalize_collection_title(poster['title']):
             item_found = True
 
-            if check_label_for_item(item.ratingKey) and not overwrite_labelled_shows:
+            if upload_mode != "assets" and labelled_by_earlier_run(item.ratingKey) and not overwrite_labelled_shows:
                 #print(f"Skipping upload for {poster['title']} as it already has the label '{append_label}'.")
                 break
 
             # Determine asset type
-            asset_type = ("poster" if poster.get("source") == "posterdb"  else {"poster": "poster", "background": "background", "backdrop": "background"}.get(poster.get("file_type"), "poster") )
+            asset_type = get_asset_type(poster)
 
             if asset_type in {"poster", "background"}:
                 asset_path = f"collections/{poster['title']}" if asset_folders else "collections"
@@ -500,11 +1339,19 @@ def upload_collection_poster(poster, plex_collections):
             file_path = get_asset_file_path(assets_directory, asset_path, file_name)
             
             # Check if the asset already exists
-            if os.path.exists(file_path) and not overwrite_existing_assets:
+            if upload_mode == "assets":
+                save_asset(asset_path, file_name, file_path, poster)
+                break
+            elif upload_mode == "url":
+                file_path = None
+            elif os.path.exists(file_path) and not overwrite_existing_assets:
                 if only_process_new_assets:
                     #print(f"Skipping upload for {poster['title']} as the {asset_type} already exists.")
                     break
                 #print(f"Using existing file for upload to {poster['title']}.")
+            elif upload_mode == "hybrid":
+                save_in_background(assets_directory, asset_path, file_name, poster["url"])
+                file_path = None
             else:
                 file_path = save_to_assets_directory(assets_directory, asset_path, file_name, poster["url"])
                 if not file_path:
@@ -512,22 +1359,17 @@ def upload_collection_poster(poster, plex_collections):
                     break
             
             try:
-                # Upload the poster or background to the collection
-                if asset_type == 'poster':
-                    item.uploadPoster(filepath=file_path)
-                    item.lockPoster()
-                elif asset_type == 'background':
-                    item.uploadArt(filepath=file_path)
-                    item.lockArt()
-                else:
-                    print(f"Unknown asset type '{asset_type}' for {poster['title']}.")
+                if art_unchanged(item, item, asset_type, file_path, poster["url"]):
+                    print(f'Skipping upload for {poster["title"]}, Plex already has this {asset_type}.')
                     break
-                print(f'Uploaded {asset_type} for {poster["title"]}.')
-                
-                # Add labels to the collection item after upload
-                add_label_rating_key(item)
-                
-                time.sleep(6)  # Timeout to prevent spamming servers
+                with upload_semaphore:
+                    # Upload the poster or background to the collection
+                    upload_art(item, asset_type, file_path, poster["url"])
+                    print(f'Uploaded {asset_type} for {poster["title"]}.')
+
+                    # Add labels to the collection item after upload
+                    add_label_rating_key(item)
+                    record_upload(asset_slot(poster, "collection"), item.ratingKey, poster["url"], file_path, asset_type)
             except Exception as e:
                 print(f'Unable to upload {asset_type} for {poster["title"]}. Error: {e}')
             break
@@ -536,6 +1378,126 @@ def upload_collection_poster(poster, plex_collections):
         print(f"Item with title '{poster['title']}' not found in collections.")
 
 
+def open_state_database(path):
+    global STATE_DB
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, commits no longer wait for the disk
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS assets ("
+        "slot TEXT PRIMARY KEY, "
+        "rating_key TEXT, "
+        "source_url TEXT, "
+        "asset_hash TEXT, "
+        "uploaded_at REAL)"
+    )
+    # Databases written before uploads recorded their artwork type
+    if "art_type" not in {column[1] for column in connection.execute("PRAGMA table_info(assets)")}:
+        connection.execute("ALTER TABLE assets ADD COLUMN art_type TEXT")
+    connection.execute("CREATE INDEX IF NOT EXISTS assets_by_item ON assets (rating_key, art_type)")
+    # Validators of downloaded images (and of .part files being downloaded), keyed by file path
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS downloads ("
+        "path TEXT PRIMARY KEY, "
+        "url TEXT, "
+        "etag TEXT, "
+        "last_modified TEXT, "
+        "content_length INTEGER, "
+        "downloaded_at REAL)"
+    )
+    connection.commit()
+    STATE_DB = connection
+    return connection
+
+
+def asset_slot(poster, kind):
+    # Identifies the Plex item and artwork slot a poster is meant for without asking Plex
+    item = poster.get("id") or f"{normalize_title(poster['title'])}|{poster.get('year') or ''}"
+    if kind == "show":
+        return f"show|{poster.get('source')}|{item}|{poster.get('season')}|{poster.get('episode')}"
+    return f"{kind}|{poster.get('source')}|{item}|{get_asset_type(poster)}"
+
+
+def file_hash(file_path, algorithm=hashlib.sha256):
+    digest = algorithm()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def uploaded_sources(slots):
+    # Source URLs recorded for these slots, queried in chunks below SQLite's variable limit
+    slots = list(dict.fromkeys(slots))
+    sources = {}
+    with state_db_lock:
+        for start in range(0, len(slots), 500):
+            chunk = slots[start:start + 500]
+            sources.update(STATE_DB.execute(
+                f"SELECT slot, source_url FROM assets WHERE slot IN ({', '.join('?' * len(chunk))})", chunk).fetchall())
+    return sources
+
+
+def record_upload(slot, rating_key, source_url, file_path, art_type=None):
+    if STATE_DB is None:
+        return
+    try:
+        asset_hash = file_hash(file_path) if file_path else None
+    except OSError:
+        asset_hash = None
+    with state_db_lock:
+        STATE_DB.execute(
+            "INSERT OR REPLACE INTO assets (slot, rating_key, source_url, asset_hash, uploaded_at, art_type) VALUES (?, ?, ?, ?, ?, ?)",
+            (slot, str(rating_key), source_url, asset_hash, time.time(), art_type),
+        )
+        STATE_DB.commit()
+
+
+def last_upload(rating_key, art_type):
+    # (source_url, asset_hash) of the latest upload to this item and artwork type, from any slot
+    if STATE_DB is None:
+        return None
+    with state_db_lock:
+        return STATE_DB.execute(
+            "SELECT source_url, asset_hash FROM assets WHERE rating_key = ? AND art_type = ? ORDER BY uploaded_at DESC LIMIT 1",
+            (str(rating_key), art_type),
+        ).fetchone()
+
+
+def download_record(file_path, url):
+    # Validators recorded when file_path was downloaded from url
+    if STATE_DB is None:
+        return None
+    with state_db_lock:
+        row = STATE_DB.execute(
+            "SELECT etag, last_modified, content_length FROM downloads WHERE path = ? AND url = ?",
+            (os.path.normpath(file_path), url),
+        ).fetchone()
+    return dict(zip(("etag", "last_modified", "content_length"), row)) if row else None
+
+
+def record_download(file_path, url, response, size, part_path=None):
+    # part_path: the finished .part file whose record is replaced by this one
+    if STATE_DB is None:
+        return
+    with state_db_lock:
+        STATE_DB.execute(
+            "INSERT OR REPLACE INTO downloads (path, url, etag, last_modified, content_length, downloaded_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (os.path.normpath(file_path), url, response.headers.get("ETag"), response.headers.get("Last-Modified"), size, time.time()),
+        )
+        if part_path:
+            STATE_DB.execute("DELETE FROM downloads WHERE path = ?", (os.path.normpath(part_path),))
+        STATE_DB.commit()
+
+
+def forget_download(file_path):
+    if STATE_DB is None:
+        return
+    with state_db_lock:
+        STATE_DB.execute("DELETE FROM downloads WHERE path = ?", (os.path.normpath(file_path),))
+        STATE_DB.commit()
+
+
 def set_posters(url):
     result = scrape(url)
 
@@ -549,15 +1511,49 @@ def set_posters(url):
         #print("No posters found.")
         return
 
-    for poster in collectionposters:
-        upload_collection_poster(poster, plex_collections)
+    process_posters(movieposters, showposters, collectionposters)
+
+
+def poster_jobs(movieposters, showposters, collectionposters):
+    jobs = ([(upload_collection_poster, poster, plex_collections, "collection") for poster in collectionposters] +
+            [(upload_movie_poster, poster, movies, "movie") for poster in movieposters] +
+            [(upload_tv_poster, poster, tv, "show") for poster in showposters])
 
-    for poster in movieposters:
-        upload_movie_poster(poster, movies)
+    unchanged = unchanged_posters([(kind, poster) for _, poster, _, kind in jobs])
+    return [job for index, job in enumerate(jobs) if index not in unchanged]
 
-    for poster in showposters:
-        upload_tv_poster(poster, tv)
 
+def unchanged_posters(entries):
+    # Indexes of the (kind, poster) entries that were already uploaded from the same source, found before
+    # doing any network work; assets mode goes by the files on disk instead
+    if STATE_DB is None or overwrite_existing_assets or upload_mode == "assets":
+        return set()
+    slots = [asset_slot(poster, kind) for kind, poster in entries]
+    uploaded = uploaded_sources(slots)
+    unchanged = {index for index, ((_, poster), slot) in enumerate(zip(entries, slots)) if uploaded.get(slot) == poster["url"]}
+    if unchanged:
+        print(f"Skipping {len(unchanged)} posters that are unchanged since the last run.")
+    return unchanged
+
+
+def submit_poster_jobs(executor, jobs):
+    return {executor.submit(upload_func, poster, libraries): poster for upload_func, poster, libraries, _ in jobs}
+
+
+def report_poster_errors(futures):
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Error processing {futures[future].get('title')}: {e}")
+
+
+def process_posters(movieposters, showposters, collectionposters):
+    # Lookups and downloads run in the worker pool, uploads are limited by upload_semaphore
+    jobs = poster_jobs(movieposters, showposters, collectionposters)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        report_poster_errors(submit_poster_jobs(executor, jobs))
+    flush_asset_writes()
 
 
 def scrape_posterdb_set_link(soup):
@@ -578,33 +1574,18 @@ def scrape_posterd_user_info(soup):
         return None
 
 
-def scrape_mediux_user_info(base_url):
-    current_page = 1
-    total_pages = 1
-
-    while True:
-        page_url = f"{base_url}?page={current_page}"
-        #print(f"Processing page: {current_page}")
-        soup = cook_soup(page_url)
-
-        # Extract all page numbers from links
-        page_links = soup.select('a[href*="page="]')
-        page_numbers = [
-            int(re.search(r"page=(\d+)", a["href"]).group(1))
-            for a in page_links
-            if re.search(r"page=(\d+)", a["href"])
-        ]
-        if page_numbers:
-            total_pages = max(page_numbers)
-
-        # Get the next page link
-        next_page_link = soup.select_one('a[aria-label="Go to next page"]')
-        if next_page_link and (match := re.search(r"page=(\d+)", next_page_link["href"])):
-            current_page = int(match.group(1))
-        else:
-            break
-
-    return total_pages
+def scrape_mediux_user_info(soup):
+    # Extract all page numbers from the pagination links, the highest one is the page count
+    if isinstance(soup, str):
+        hrefs = re.findall(r'href="([^"]*page=\d+[^"]*)"', soup)
+    else:
+        hrefs = [a["href"] for a in soup.select('a[href*="page="]')]
+    page_numbers = [
+        int(re.search(r"page=(\d+)", href).group(1))
+        for href in hrefs
+        if re.search(r"page=(\d+)", href)
+    ]
+    return max(page_numbers) if page_numbers else 1
 
 
 def scrape_posterdb(soup):
@@ -612,6 +1593,9 @@ def scrape_posterdb(soup):
     showposters = []
     collectionposters = []
 
+    if isinstance(soup, str):
+        soup = make_soup(soup)
+
     # Find the poster grid
     poster_div = soup.find("div", class_="row d-flex flex-wrap m-0 w-100 mx-n1 mt-n1")
     if not poster_div:
@@ -674,7 +1658,11 @@ def scrape_posterdb(soup):
 
 
 def get_mediux_filters():
-    config = json.load(open("config.json"))
+    # Without a config file (e.g. scraping offline fixtures) every file type is kept
+    if not os.path.exists("config.json"):
+        return None
+    with open("config.json") as config_file:
+        config = json.load(config_file)
     return config.get("mediux_filters", None)
 
 
@@ -686,8 +1674,6 @@ def scrape_mediux(soup):
     base_url = "https://mediux.pro/_next/image?url=https%3A%2F%2Fapi.mediux.pro%2Fassets%2F"
     quality_suffix = "&w=3840&q=80"
 
-    scripts = soup.find_all("script")
-
     media_type = None
     showposters = []
     movieposters = []
@@ -696,14 +1682,15 @@ def scrape_mediux(soup):
     title = None
     poster_data = []
 
-    # Extract and parse the poster data from the script tags
-    for script in scripts:
-        if "files" in script.text and "set" in script.text and "Set Link\\" not in script.text:
-            data_dict = parse_string_to_dict(script.text)
-            poster_data = data_dict.get("set", {}).get("files", [])
+    # Extract and parse the poster data from the last matching script tag
+    scripts = mediux_data_scripts(soup)
+    if scripts:
+        data_dict = parse_string_to_dict(scripts[-1])
+        poster_data = data_dict.get("set", {}).get("files", [])
 
-    # Determine media type based on the presence of specific IDs
-    for data in poster_data:
+    # Media type follows the last file of the set
+    if poster_data:
+        data = poster_data[-1]
         if (data.get("show_id") or data.get("show_id_backdrop") or 
             data.get("episode_id") or data.get("season_id") or 
             data.get("show_id")):
@@ -711,25 +1698,47 @@ def scrape_mediux(soup):
         else:
             media_type = "Movie"
 
+    # Index the set once so every file below is a dictionary lookup
+    if media_type == "Show":
+        show = data_dict["set"].get("show", {})
+        episodes = show.get("seasons", [])
+        show_name = show.get("name", "Unknown")
+        show_tvdb_id = show.get("tvdb_id")
+        first_air_date = data_dict["set"]["show"].get("first_air_date", "0000")
+        year = int(first_air_date.split('-')[0] if first_air_date and '-' in first_air_date else first_air_date[:4]) if first_air_date else 0000
+
+        seasons_by_number, seasons_by_id, episodes_by_season = {}, {}, {}
+        for season_data in episodes:
+            seasons_by_number.setdefault(season_data.get("season_number"), season_data)
+            seasons_by_id.setdefault(season_data.get("id"), season_data)
+        for season_number, season_data in seasons_by_number.items():
+            season_episodes = episodes_by_season[season_number] = {}
+            for episode_data in season_data.get("episodes", []):
+                season_episodes.setdefault(episode_data.get("id"), episode_data)
+
+    elif media_type == "Movie":
+        set_movie = data_dict["set"].get("movie")
+        set_collection = data_dict["set"].get("collection")
+        movies_by_id = {}
+        for movie_data in (set_collection or {}).get("movies", []) if not set_movie else []:
+            movies_by_id.setdefault(movie_data.get("id"), movie_data)
+        backdrops_by_movie = {}
+        for file in poster_data:
+            movie_id_backdrop = file.get("movie_id_backdrop")
+            if movie_id_backdrop and isinstance(movie_id_backdrop, dict) and movie_id_backdrop.get("id"):
+                backdrops_by_movie.setdefault(movie_id_backdrop["id"], []).append(file["id"])
+
     # Process each poster data entry
     for data in poster_data:
         image_stub = data.get("id")
         poster_url = f"{base_url}{image_stub}{quality_suffix}"
 
         if media_type == "Show":
-            episodes = data_dict["set"].get("show", {}).get("seasons", [])
-            show_name = data_dict["set"].get("show", {}).get("name", "Unknown")
-            show_tvdb_id = data_dict["set"].get("show", {}).get("tvdb_id")
-            first_air_date = data_dict["set"]["show"].get("first_air_date", "0000")
-            year = int(first_air_date.split('-')[0] if first_air_date and '-' in first_air_date else first_air_date[:4]) if first_air_date else 0000
-
-
             if data.get("fileType") == "title_card":
                 file_type = "title_card"
                 episode_id = data.get("episode_id", {}).get("id")
                 season = data.get("episode_id", {}).get("season_id", {}).get("season_number")
-                season_data = next((ep for ep in episodes if ep.get("season_number") == season), {})
-                episode_data = next((ep for ep in season_data.get("episodes", []) if ep.get("id") == episode_id), {})
+                episode_data = episodes_by_season.get(season, {}).get(episode_id, {})
                 episode = episode_data.get("episode_number", "")
                 if not episode:
                     title = data.get("title", "")
@@ -747,7 +1756,7 @@ def scrape_mediux(soup):
                 file_type = "background"
             elif data.get("season_id"):
                 season_id = data.get("season_id", {}).get("id")
-                season_data = next((ep for ep in episodes if ep["id"] == season_id), {})
+                season_data = seasons_by_id.get(season_id, {})
                 episode = "Cover"
                 season = season_data.get("season_number")
                 file_type = "season_cover"
@@ -776,13 +1785,12 @@ def scrape_mediux(soup):
             if data.get("movie_id"):
                 if data.get("movie_id").get("id"):
                     movie_id = data.get("movie_id", {}).get("id")
-                    if data_dict["set"].get("movie"):
-                        title = data_dict["set"]["movie"].get("title", "Unknown")
-                        release_date = data_dict["set"]["movie"].get("release_date", "0000")
+                    if set_movie:
+                        title = set_movie.get("title", "Unknown")
+                        release_date = set_movie.get("release_date", "0000")
                         year = int(release_date.split('-')[0]) if release_date and '-' in release_date else int(release_date[:4]) if release_date else 0000
-                    elif data_dict["set"].get("collection"):
-                        movies = data_dict["set"]["collection"].get("movies", [])
-                        movie_data = next((movie for movie in movies if movie["id"] == movie_id), {})
+                    elif set_collection:
+                        movie_data = movies_by_id.get(movie_id, {})
                         title = movie_data.get("title", "Unknown")
                         release_date = movie_data.get("release_date", "0000")
                         year = int(release_date.split('-')[0]) if release_date and '-' in release_date else int(release_date[:4]) if release_date else 0000
@@ -798,22 +1806,18 @@ def scrape_mediux(soup):
                         "file_type": "poster"
                     }
                     movieposters.append(movieposter)
-                    # Check and add movie backdrop
-                    for file in data_dict["set"].get("files", []):
-                        movie_id_backdrop = file.get("movie_id_backdrop")
-                        if movie_id_backdrop and isinstance(movie_id_backdrop, dict):
-                            backdrop_id = movie_id_backdrop.get("id")
-                            if backdrop_id and backdrop_id == movie_id:
-                                backdrop_url = f"{base_url}{file['id']}{quality_suffix}"
-                                movieposter_background = {
-                                    "media_type": media_type,
-                                    "title": title,
-                                    "id": movie_id,
-                                    "url": backdrop_url,
-                                    "source": "mediux",
-                                    "file_type": "background"
-                                }
-                                movieposters.append(movieposter_background)
+                    # Add the movie's backdrops
+                    for backdrop_file_id in backdrops_by_movie.get(movie_id, []):
+                        backdrop_url = f"{base_url}{backdrop_file_id}{quality_suffix}"
+                        movieposter_background = {
+                            "media_type": media_type,
+                            "title": title,
+                            "id": movie_id,
+                            "url": backdrop_url,
+                            "source": "mediux",
+                            "file_type": "background"
+                        }
+                        movieposters.append(movieposter_background)
             if data.get("collection_id"):
                 if data.get("collection_id").get('id'):
                     collection_id = data.get("collection_id").get("id")
@@ -827,7 +1831,7 @@ def scrape_mediux(soup):
                             "file_type": "poster"
                         }
                         collectionposters.append(collectionposter)
-                        if 'backdropCheck' in data_dict["set"] and data_dict["set"]['backdropCheck']:
+                        if data_dict["set"].get('backdropCheck'):
                             for backdrop in data_dict["set"]['backdropCheck']:
                                 backdrop_id = backdrop['id']
                                 backdrop_url = f"{base_url}{backdrop_id}{quality_suffix}"
@@ -838,40 +1842,114 @@ def scrape_mediux(soup):
                                     "source": "mediux",
                                     "file_type": "background"
                                 }
-                                collectionposters.append(collectionposter_background)                      
+                                collectionposters.append(collectionposter_background)
     return movieposters, showposters, collectionposters
 
 
+def extract_boxset_set_ids(soup):
+    scripts = mediux_data_scripts(soup)
+    data_dict = parse_string_to_dict(scripts[0]) if scripts else {}
+
+    if not data_dict.get("boxset", {}).get("sets"):
+        print("No relevant data found or invalid structure.")
+        return []
+
+    return [item["id"] for item in data_dict["boxset"]["sets"]]
+
+
 def process_boxset_url(boxset_id, soup2):
     boxset_url = f"https://mediux.pro/boxsets/{boxset_id}"
     print(f"Fetching boxset data from: {boxset_url}")
 
-    scripts = soup2.find_all("script")
-    data_dict = {}
+    set_ids = extract_boxset_set_ids(soup2)
+    if not set_ids:
+        return []
+    #print(f"Extracted set IDs: {set_ids}")
 
-    for script in scripts:
-        script_text = script.text
-        if "files" in script_text and "set" in script_text and "Set Link\\" not in script_text:
-            data_dict = parse_string_to_dict(script_text)
-            break
+    # Child sets are scraped in parallel and uploaded together as one batch by set_posters
+    results = scrape_urls([f"https://mediux.pro/sets/{set_id}" for set_id in set_ids])
+    return merge_poster_results(results)
 
-    if not data_dict.get("boxset", {}).get("sets"):
-        print("No relevant data found or invalid structure.")
-        return []
 
-    set_ids = [item["id"] for item in data_dict["boxset"]["sets"]]
-    #print(f"Extracted set IDs: {set_ids}")
+def scrape_urls(urls, scrape_func=None):
+    # Scrapes several URLs in parallel, errors are reported per URL without stopping the others
+    results = {}
+    with ThreadPoolExecutor(max_workers=http_pool_size) as executor:
+        futures = {executor.submit(scrape_func or scrape, url): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except (Exception, SystemExit) as e:
+                print(f"Error processing {futures[future]}: {e}")
 
-    results = []
-    for set_id in set_ids:
+    return [results.get(url) for url in urls]
+
+
+def set_id_from_url(url):
+    parts = urllib.parse.urlsplit(url)
+    set_id = parts.path.rstrip("/").split("/")[-1] + (f"-{parts.query}" if parts.query else "")
+    return re.sub(r"[^\w.-]", "_", set_id)
+
+
+def relevant_payload(source, html):
+    if source == "mediux":
+        # The set data lives in the Next.js script payload, filters change the parsed output
+        return "".join(mediux_data_scripts(html)) + json.dumps(get_mediux_filters())
+    # ThePosterDB: the poster grid onwards, without the per-request CSRF token
+    grid_start = html.find("row d-flex flex-wrap m-0 w-100 mx-n1 mt-n1")
+    return re.sub(r'(csrf-token|_token)"[^>]*>', "", html[max(grid_start, 0):])
+
+
+def parsed_set_path(source, set_id):
+    return os.path.join(parsed_set_directory, f"{source}-{set_id}.json")
+
+
+def load_parsed_set(source, set_id, payload_hash):
+    try:
+        with open(parsed_set_path(source, set_id), "r", encoding="utf-8") as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if entry.get("version") != PARSER_VERSION or entry.get("hash") != payload_hash:
+        return None
+    return tuple(entry["result"])
+
+
+def store_parsed_set(source, set_id, payload_hash, result):
+    os.makedirs(parsed_set_directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=parsed_set_directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump({"version": PARSER_VERSION, "hash": payload_hash, "result": list(result)}, file)
+        os.replace(temp_path, parsed_set_path(source, set_id))
+    except OSError as e:
+        print(f"Failed to store parsed set {source} {set_id}: {e}")
         try:
-            set_results = set_posters(f"https://mediux.pro/sets/{set_id}")
-            if set_results:
-                results.extend(set_results)
-        except Exception as e:
-            print(f"Error processing set {set_id}: {e}")
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def invalidate_parsed_set(source, set_id):
+    try:
+        os.remove(parsed_set_path(source, set_id))
+    except FileNotFoundError:
+        pass
 
-    return results
+
+def scrape_set_page(source, url, parse):
+    html = fetch_page(url)
+    if not parsed_set_cache:
+        return parse(html)
+
+    set_id = set_id_from_url(url)
+    payload_hash = hashlib.sha256(relevant_payload(source, html).encode("utf-8")).hexdigest()
+    result = load_parsed_set(source, set_id, payload_hash)
+    if result is None:
+        result = parse(html)
+        if result:
+            store_parsed_set(source, set_id, payload_hash, result)
+    return result
 
 
 def scrape(url):
@@ -879,17 +1957,14 @@ def scrape(url):
 
     if "theposterdb.com" in url:
         if "/set/" in url:
-            soup = cook_soup(url)
-            return scrape_posterdb(soup)
+            return scrape_set_page("posterdb", url, scrape_posterdb)
         elif "/user/" in url:
-            soup = cook_soup(url)
-            return scrape_entire_user(soup)
+            return scrape_posterdb_user(url)
         elif "/poster/" in url:
             soup = cook_soup(url)
             set_url = scrape_posterdb_set_link(soup)
             if set_url:
-                set_soup = cook_soup(set_url)
-                return scrape_posterdb(set_soup)
+                return scrape_set_page("posterdb", set_url, scrape_posterdb)
             else:
                 sys.exit("Poster set not found. Check the link you are inputting.")
         else:
@@ -899,29 +1974,98 @@ def scrape(url):
         if "/boxsets/" in url:
             #print("Detected Mediux Boxset URL.")
             boxset_id = url.split("/")[-1]
-            soup = cook_soup(url)
-            return process_boxset_url(boxset_id, soup)
+            return process_boxset_url(boxset_id, fetch_page(url))
         elif "/user/" in url:
-            soup = cook_soup(url)
-            return scrape_mediux_user(soup)
+            return scrape_mediux_user(url)
         elif "/sets/" in url:
             #print("Detected Mediux Set URL.")
-            soup = cook_soup(url)
-            return scrape_mediux(soup)
+            return scrape_set_page("mediux", url, scrape_mediux)
         else:
             sys.exit("Invalid Mediux URL. Check the link you are inputting.")
 
     elif ".html" in url:
         #print("Detected local HTML file.")
-        with open(url, "r", encoding="utf-8") as file:
-            html_content = file.read()
-        soup = BeautifulSoup(html_content, "html.parser")
-        return scrape_posterdb(soup)
+        return scrape_local_file(url)
 
     else:
         sys.exit("Invalid URL. Check the link you are inputting.")
 
 
+def detect_page_source(html):
+    # Saved pages are told apart by their content, file names say nothing about the site
+    if "row d-flex flex-wrap m-0 w-100 mx-n1 mt-n1" in html:
+        return "posterdb"
+    if mediux_data_scripts(html):
+        return "mediux"
+    if "theposterdb.com" in html:
+        return "posterdb"
+    return None
+
+
+def scrape_local_file(path):
+    with open(path, "r", encoding="utf-8") as file:
+        html_content = file.read()
+
+    source = detect_page_source(html_content)
+    if source == "mediux":
+        return scrape_mediux(html_content)
+    elif source == "posterdb":
+        return scrape_posterdb(html_content)
+    raise Exception("Not a saved ThePosterDB or MediUX page")
+
+
+def parse_local_file(path):
+    # Runs in the parsing processes, errors are returned so one bad file does not stop the batch
+    try:
+        return path, scrape_local_file(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def init_local_parser(parser):
+    # Worker processes may start from a fresh import, so the parser chosen on the command line is passed along
+    global html_parser
+    html_parser = parser
+
+
+def local_html_files(pattern):
+    if os.path.isdir(pattern):
+        paths = glob.glob(os.path.join(pattern, "**", "*.htm*"), recursive=True)
+    else:
+        paths = glob.glob(pattern, recursive=True)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def parse_local_files(pattern):
+    paths = local_html_files(pattern)
+    if not paths:
+        print(f"No HTML files found for {pattern}.")
+        return
+
+    workers = min(local_parse_workers or os.cpu_count() or 1, len(paths))
+    print(f"Parsing {len(paths)} local HTML files with {workers} processes.")
+
+    # Files are parsed across processes and each file's posters go to the upload pool as soon as
+    # it is parsed; a poster slot another file already filled is not uploaded twice
+    seen = set()
+    futures = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_local_parser, initargs=(html_parser,)) as parsers, \
+            ThreadPoolExecutor(max_workers=max_workers) as uploads:
+        for path, result, error in parsers.map(parse_local_file, paths, chunksize=max(1, len(paths) // (workers * 4))):
+            if error:
+                print(f"Error parsing {path}: {error}")
+                continue
+
+            fresh = []
+            for kind, posters in zip(("movie", "show", "collection"), result):
+                fresh.append([poster for poster in posters if (kind, asset_slot(poster, kind)) not in seen])
+                seen.update((kind, asset_slot(poster, kind)) for poster in posters)
+            futures.update(submit_poster_jobs(uploads, poster_jobs(*fresh)))
+
+        report_poster_errors(futures)
+    flush_asset_writes()
+
+
 # Checks if url does not start with "//", "#", or is blank
 def is_not_comment(url):
     regex = r"^(?!\/\/|#|$).+"
@@ -933,71 +2077,195 @@ def parse_urls(file_path):
     try:
         with open(file_path, "r", encoding="utf-8") as file:
             urls = [url.strip() for url in file if is_not_comment(url.strip())]
-
-        for url in urls:
-            lower_url = url.lower()
-            if "/user/" in lower_url:
-                if "theposterdb.com" in lower_url:
-                    scrape_entire_user(url)
-                elif "mediux.pro" in lower_url:
-                    scrape_mediux_user(url)
-            else:
-                set_posters(url)
-
     except FileNotFoundError:
         print("File not found. Please enter a valid file path.")
+        return
 
+    movieposters, showposters, collectionposters = collect_bulk_posters(urls)
+    process_posters(movieposters, showposters, collectionposters)
+
+
+def expand_url(url):
+    # Turns a bulk file line into the set pages it stands for
+    lower_url = url.lower()
+    if "mediux.pro" in lower_url:
+        if "/user/" in lower_url:
+            set_ids, boxset_ids = set(), set()
+            for page_set_ids, page_boxset_ids in iter_mediux_user_ids(url):
+                set_ids.update(page_set_ids)
+                boxset_ids.update(page_boxset_ids)
+            set_urls = [f"https://mediux.pro/sets/{set_id}" for set_id in sorted(set_ids, key=str)]
+            for boxset_id in sorted(boxset_ids, key=str):
+                set_urls.extend(expand_url(f"https://mediux.pro/boxsets/{boxset_id}"))
+            return set_urls
+        elif "/boxsets/" in lower_url:
+            return [f"https://mediux.pro/sets/{set_id}" for set_id in extract_boxset_set_ids(fetch_page(url))]
+    elif "theposterdb.com" in lower_url:
+        if "/user/" in lower_url:
+            return posterdb_user_page_urls(url)
+        elif "/poster/" in lower_url:
+            set_url = scrape_posterdb_set_link(cook_soup(url))
+            if set_url:
+                return [set_url]
+            print(f"Poster set not found for {url}.")
+            return []
+    return [url]
 
-def scrape_entire_user(url):
+
+def scrape_set_url(url):
+    # User upload pages are scraped as single pages, everything else like any other URL
+    if "theposterdb.com" in url and "/user/" in url:
+        return scrape_set_page("posterdb", url, scrape_posterdb)
+    return scrape(url)
+
+
+def upload_target_key(kind, poster):
+    # The Plex item and artwork slot a poster ends up on, falling back to the poster's own identity
+    try:
+        if kind == "collection":
+            items = find_collection(plex_collections, poster)
+            item = items[0] if items else None
+        else:
+            item, _ = find_in_library(tv if kind == "show" else movies, poster)
+    except Exception:
+        item = None
+    if item is None:
+        return asset_slot(poster, kind)
+    if kind == "show":
+        return f"{item.ratingKey}|{poster.get('season')}|{poster.get('episode')}"
+    return f"{item.ratingKey}|{get_asset_type(poster)}"
+
+
+def collect_bulk_posters(urls):
+    # Expand every line into set pages, scrape each page once and keep one poster per
+    # Plex item and artwork slot; when lines disagree the later line wins
+    with ThreadPoolExecutor(max_workers=http_pool_size) as executor:
+        futures = [executor.submit(expand_url, url) for url in urls]
+        expanded = []
+        for url, future in zip(urls, futures):
+            try:
+                expanded.append(future.result())
+            except (Exception, SystemExit) as e:
+                print(f"Error expanding {url}: {e}")
+                expanded.append([])
+
+    set_lines = {}
+    for line, set_urls in enumerate(expanded):
+        for set_url in set_urls:
+            source = "mediux" if "mediux.pro" in set_url else "posterdb" if "theposterdb.com" in set_url else "local"
+            key = (source, set_id_from_url(set_url) if source != "local" else set_url)
+            set_lines[key] = (line, set_url)
+
+    ordered_sets = sorted(set_lines.values())
+    results = scrape_urls([set_url for _, set_url in ordered_sets], scrape_set_url)
+
+    # One poster per slot first, remembering how late it came so it also wins when slots share a Plex item
+    slots = {}
+    order = 0
+    for result in results:
+        if not result:
+            continue
+        for kind, posters in zip(("movie", "show", "collection"), result):
+            for poster in posters:
+                slots[(kind, asset_slot(poster, kind))] = (order, poster)
+                order += 1
+    entries = [(kind, order, poster) for (kind, _), (order, poster) in slots.items()]
+    unchanged = unchanged_posters([(kind, poster) for kind, _, poster in entries])
+    entries = [entry for index, entry in enumerate(entries) if index not in unchanged]
+
+    # Only the remaining posters are looked up in Plex, in the worker pool
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        keys = list(executor.map(lambda entry: upload_target_key(entry[0], entry[2]), entries))
+    targets = {}
+    for (kind, order, poster), key in zip(entries, keys):
+        if order >= targets.get((kind, key), (-1, None))[0]:
+            targets[(kind, key)] = (order, poster)
+
+    print(f"Bulk file expanded to {len(ordered_sets)} sets and {len(targets)} posters.")
+    grouped = {"movie": [], "show": [], "collection": []}
+    for (kind, _), (_, poster) in targets.items():
+        grouped[kind].append(poster)
+    return grouped["movie"], grouped["show"], grouped["collection"]
+
+
+def posterdb_user_page_urls(url):
     soup = cook_soup(url)
     pages = scrape_posterd_user_info(soup)
+    if not pages:
+        print("Error retrieving page count.")
+        return []
 
     base_url = url.split("?")[0]
-    for page in range(1, pages + 1):
-        #print(f"Scraping page {page}.")
-        page_url = f"{base_url}?section=uploads&page={page}"
-        set_posters(page_url)
+    return [f"{base_url}?section=uploads&page={page}" for page in range(1, pages + 1)]
 
 
-def scrape_mediux_user(url):
-    #print(f"Attempting to scrape '{url}' ...please be patient.")
+def scrape_posterdb_user(url):
+    page_urls = posterdb_user_page_urls(url)
+
+    # Fetch and parse the upload pages in parallel, merged in page order afterwards
+    return merge_poster_results(scrape_urls(page_urls, lambda page_url: scrape_set_page("posterdb", page_url, scrape_posterdb)))
+
+
+def merge_poster_results(results):
+    # Combines (movie, show, collection) poster lists and drops duplicate posters
+    merged = ([], [], [])
+    seen = set()
+    for result in results:
+        if not result:
+            continue
+        for posters, merged_posters in zip(result, merged):
+            for poster in posters:
+                key = tuple(sorted(poster.items()))
+                if key not in seen:
+                    seen.add(key)
+                    merged_posters.append(poster)
+    return merged
+
+
+def scrape_entire_user(url):
+    movieposters, showposters, collectionposters = scrape_posterdb_user(url)
+    process_posters(movieposters, showposters, collectionposters)
+
+
+def iter_mediux_user_ids(url):
+    # Yields (set_ids, boxset_ids) for each page of a MediUX user as the pages arrive
     base_url = url.split('?')[0]
     
     if not base_url.endswith('/sets'):
         base_url = base_url.rstrip('/') + '/sets'
 
-    pages = scrape_mediux_user_info(base_url)
-    if pages is None:
-        print("Error retrieving page count.")
-        return
+    first_page = fetch_page(f"{base_url}?page=1")
+    pages = scrape_mediux_user_info(first_page)
 
     #print(f"Found {pages} pages for '{base_url}'")
-    all_set_ids, all_boxset_ids = [], []
-    for page in range(1, pages + 1):
-        page_url = f"{base_url}?page={page}"
-        #print(f"Scraping page {page}.")
-        page_soup = cook_soup(page_url)
-        
-        set_ids, boxset_ids = extract_ids_from_script(page_soup)
-        all_set_ids.extend(set_ids)
-        all_boxset_ids.extend(boxset_ids)
+    with ThreadPoolExecutor(max_workers=http_pool_size) as executor:
+        futures = {executor.submit(fetch_page, f"{base_url}?page={page}"): page for page in range(2, pages + 1)}
+        yield extract_ids_from_script(first_page)
+        for future in as_completed(futures):
+            try:
+                page_html = future.result()
+            except (Exception, SystemExit) as e:
+                print(f"Error fetching page {futures[future]} of '{base_url}': {e}")
+                continue
+            yield extract_ids_from_script(page_html)
 
-    unique_set_ids = list(set(all_set_ids))
-    unique_boxset_ids = list(set(all_boxset_ids))
-    
-    #print("Processing Sets:", unique_set_ids)
-    #print("Processing Box Sets:", unique_boxset_ids)
-    process_ids(unique_set_ids, unique_boxset_ids)
 
+def scrape_mediux_user(url):
+    #print(f"Attempting to scrape '{url}' ...please be patient.")
+    seen_set_ids, seen_boxset_ids = set(), set()
 
-def extract_ids_from_script(soup):
-    scripts = soup.find_all("script")
-    data_dict = {}
+    # Sets and boxsets are processed as soon as their page arrives
+    for set_ids, boxset_ids in iter_mediux_user_ids(url):
+        new_set_ids = [set_id for set_id in set_ids if set_id not in seen_set_ids]
+        new_boxset_ids = [boxset_id for boxset_id in boxset_ids if boxset_id not in seen_boxset_ids]
+        seen_set_ids.update(new_set_ids)
+        seen_boxset_ids.update(new_boxset_ids)
+        process_ids(new_set_ids, new_boxset_ids)
 
-    for script in scripts:
-        if "files" in script.text and "set" in script.text and "Set Link\\" not in script.text:
-            data_dict = parse_string_to_dict(script.text)
-            break  # Stop searching after finding the relevant script
+
+def extract_ids_from_script(soup):
+    scripts = mediux_data_scripts(soup)
+    data_dict = parse_string_to_dict(scripts[0]) if scripts else {}
 
     if not data_dict:
         print("No relevant script data found.")
@@ -1049,7 +2317,7 @@ def process_ids(set_ids, boxset_ids):
 if __name__ == "__main__":
     sys.stdout.reconfigure(encoding="utf-8")
     # Initialize indices for cleanup later
-    oe_index = ol_index = na_index = None
+    oe_index = ol_index = na_index = hp_index = um_index = None
 
     # Parse command-line arguments for flags
     if "--OE" in sys.argv:
@@ -1066,10 +2334,20 @@ if __name__ == "__main__":
         na_index = sys.argv.index("--NA") + 1
         if na_index < len(sys.argv):
             only_process_new_assets = sys.argv[na_index].lower() == "true"
+
+    if "--HP" in sys.argv:
+        hp_index = sys.argv.index("--HP") + 1
+        if hp_index < len(sys.argv):
+            html_parser = sys.argv[hp_index]
+
+    if "--UM" in sys.argv:
+        um_index = sys.argv.index("--UM") + 1
+        if um_index < len(sys.argv):
+            upload_mode = sys.argv[um_index].lower()
     
     # Clean up sys.argv to remove processed flags and values
-    indices_to_remove = {i for i in [oe_index, ol_index, na_index] if i is not None}
-    sys.argv = [arg for i, arg in enumerate(sys.argv) if i not in indices_to_remove and arg not in ["--OE", "--OL", "--NA"]]
+    indices_to_remove = {i for i in [oe_index, ol_index, na_index, hp_index, um_index] if i is not None}
+    sys.argv = [arg for i, arg in enumerate(sys.argv) if i not in indices_to_remove and arg not in ["--OE", "--OL", "--NA", "--HP", "--UM"]]
 
     # Initialize Plex setup
     plex_setup()
@@ -1077,6 +2355,7 @@ if __name__ == "__main__":
     # Check for command input
     if len(sys.argv) > 1:
         command = sys.argv[1].lower()
+        reset_library_caches()
         
         # Handle 'bulk' command
         if command == "bulk":
@@ -1085,6 +2364,13 @@ if __name__ == "__main__":
                 parse_urls(file_path)
             else:
                 print("Please provide the path to the .txt file.")
+
+        # Handle 'local' command
+        elif command == "local":
+            if len(sys.argv) > 2:
+                parse_local_files(sys.argv[2])
+            else:
+                print("Please provide a directory or glob of saved .html pages.")
                 
         elif "/user/" in command:
             if "theposterdb.com" in command:
@@ -1093,6 +2379,7 @@ if __name__ == "__main__":
                 scrape_mediux_user(command)
         else:
             set_posters(command)
+        report_asset_store(assets_directory)
     
     else:
         # Interactive mode
@@ -1103,18 +2390,24 @@ if __name__ == "__main__":
             if user_input.lower() == "stop":
                 print("Stopping...")
                 break
+
+            # Handle 'refresh' to index the Plex libraries again
+            elif user_input.lower() == "refresh":
+                refresh_library_index()
+                print("Library index refreshed.")
+                continue
+
+            reset_library_caches()
             
             # Handle 'bulk' command for user input
-            elif user_input.lower() == "bulk":
+            if user_input.lower() == "bulk":
                 file_path = input("Enter the path to the .txt file: ").strip()
-                try:
-                    with open(file_path, "r") as file:
-                        urls = file.readlines()
-                    for url in urls:
-                        url = url.strip()
-                        set_posters(url)
-                except FileNotFoundError:
-                    print("File not found. Please enter a valid file path.")
+                parse_urls(file_path)
+
+            # Handle 'local' command for user input
+            elif user_input.lower() == "local":
+                pattern = input("Enter a directory or glob of saved .html pages: ").strip()
+                parse_local_files(pattern)
             
             # Handle URLs for individual scraping or poster setting
             elif "/user/" in user_input.lower():
@@ -1124,3 +2417,4 @@ if __name__ == "__main__":
                     scrape_mediux_user(user_input)
             else:
                 set_posters(user_input)
+            report_asset_store(assets_directory)
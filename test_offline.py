@@ -0,0 +1,697 @@
+import benchmark_end_to_end
+import benchmark_parsers
+import fake_plex_server
+import fixture_corpus
+import plex_poster_set_helper
+import pytest
+
+
+def test_rate_limiter_adapts_to_response_times():
+    limiter = plex_poster_set_helper.RateLimiter({"plex": 4}, start_interval=1.0)
+    for _ in range(20):
+        limiter.record("plex", 0.1)
+    assert limiter.hosts["plex"]["interval"] == 0.25
+
+    limiter.record("plex", 0.1, status=429)
+    assert limiter.hosts["plex"]["interval"] == 1.0
+    limiter.record("plex", 5.0)
+    assert limiter.hosts["plex"]["interval"] == 1.5
+
+
+def test_rate_limiter_host_key():
+    limiter = plex_poster_set_helper.RateLimiter()
+    assert limiter.host_key("https://api.mediux.pro/assets/abc") == "mediux.pro"
+    assert limiter.host_key("https://theposterdb.com/api/assets/1") == "theposterdb.com"
+    assert limiter.host_key("https://example.com/x") == "example.com"
+
+
+class FakeItem:
+    def __init__(self, xml):
+        self._data = plex_poster_set_helper.ET.fromstring(xml)
+        self.title = self._data.get("title")
+        self.ratingKey = self._data.get("ratingKey")
+
+
+class FakeLibrary:
+    key = "1"
+    title = "TV Shows"
+
+    def __init__(self, items):
+        self.items = items
+        self.queries = 0
+
+    def search(self, **kwargs):
+        self.queries += 1
+        return self.items if "includeGuids" in kwargs else []
+
+    def get(self, title, **kwargs):
+        self.queries += 1
+        raise plex_poster_set_helper.plexapi.exceptions.NotFound(f"Unable to find item with title '{title}'")
+
+
+def test_find_in_library_uses_index(monkeypatch):
+    monkeypatch.setattr(plex_poster_set_helper, "LIBRARY_INDEX", {})
+    show = FakeItem('<Directory ratingKey="10" title="Doctor Who" year="2005"><Guid id="tvdb://78804"/>'
+                    '<Location path="/tv/Doctor Who (2005)"/></Directory>')
+    lib = FakeLibrary([show])
+    plex_poster_set_helper.build_library_index([lib])
+
+    poster = {"source": "mediux", "media_type": "Show", "id": 78804, "title": "Doctor Who", "year": 2005}
+    assert plex_poster_set_helper.find_in_library([lib], poster) == (show, "Doctor Who (2005)")
+    poster = {"source": "posterdb", "title": "doctor  who", "year": 2005}
+    assert plex_poster_set_helper.find_in_library([lib], poster) == (show, "Doctor Who (2005)")
+
+    # Misses fall back to Plex once and are remembered for the rest of the run
+    poster = {"source": "posterdb", "title": "Torchwood", "year": 2006}
+    assert plex_poster_set_helper.find_in_library([lib], poster) == (None, None)
+    assert plex_poster_set_helper.find_in_library([lib], poster) == (None, None)
+    assert lib.queries == 2
+
+    # The next command asks again, and a refresh picks up items added to Plex since
+    plex_poster_set_helper.reset_library_caches()
+    assert plex_poster_set_helper.find_in_library([lib], poster) == (None, None)
+    assert lib.queries == 3
+    torchwood = FakeItem('<Directory ratingKey="11" title="Torchwood" year="2006"><Location path="/tv/Torchwood"/></Directory>')
+    lib.items.append(torchwood)
+    plex_poster_set_helper.refresh_library_index()
+    assert plex_poster_set_helper.find_in_library([lib], poster) == (torchwood, "Torchwood")
+    assert lib.queries == 4
+
+
+class FakeCollection:
+    def __init__(self, title):
+        self.title = title
+
+
+def test_find_collection_lists_each_library_once():
+    calls = []
+
+    class CollectionLibrary:
+        key = "2"
+        title = "Movies"
+
+        def collections(self):
+            calls.append(1)
+            return [FakeCollection("Alien Collection"), FakeCollection("The Dark Knight Collection")]
+
+    lib = CollectionLibrary()
+    plex_poster_set_helper.COLLECTION_CACHE.clear()
+    found = plex_poster_set_helper.find_collection([lib], {"title": "The Dark Knight Collection"})
+    assert [c.title for c in found] == ["The Dark Knight Collection"]
+    assert plex_poster_set_helper.find_collection([lib], {"title": "Alien"})[0].title == "Alien Collection"
+    assert plex_poster_set_helper.find_collection([lib], {"title": "Predator Collection"}) is None
+    assert len(calls) == 1
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200, headers=None):
+        self.content = content.encode() if isinstance(content, str) else content
+        self.text = self.content.decode("utf-8", "replace")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_metadata_is_fetched_once_per_rating_key(monkeypatch):
+    requested = []
+
+    def fake_http_get(url, **kwargs):
+        requested.append(url)
+        return FakeResponse('<MediaContainer><Directory ratingKey="42" title="Andor"><Label tag="Overlay"/>'
+                            '<Location path="/tv/Andor (2022)"/></Directory></MediaContainer>')
+
+    class Show:
+        ratingKey = 42
+        title = "Andor"
+        edits = None
+
+        def edit(self, **kwargs):
+            self.edits = kwargs
+
+    monkeypatch.setattr(plex_poster_set_helper, "http_get", fake_http_get)
+    monkeypatch.setattr(plex_poster_set_helper, "append_label", ["Overlay", "Mediux"])
+    plex_poster_set_helper.METADATA_CACHE.clear()
+
+    assert plex_poster_set_helper.get_file_path_from_plex(42) == "Andor (2022)"
+    assert plex_poster_set_helper.check_label_for_item(42)
+    show = Show()
+    plex_poster_set_helper.add_label_rating_key(show)
+    assert show.edits == {"label[0].tag.tag": "Overlay", "label[1].tag.tag": "Mediux", "label.locked": 1}
+    assert plex_poster_set_helper.get_plex_metadata(42)["labels"] == ["Overlay", "Mediux"]
+    assert len(requested) == 1
+
+
+def test_show_tree_is_fetched_once(monkeypatch):
+    calls = []
+
+    class Show:
+        ratingKey = 7
+        _server = None
+
+        def seasons(self):
+            calls.append("seasons")
+            return [FakeItem('<Directory title="Specials" index="0"/>'), FakeItem('<Directory title="Season 1" index="1"/>')]
+
+        def episodes(self):
+            calls.append("episodes")
+            return [FakeItem(f'<Video title="Episode {i}" parentIndex="1" index="{i}"/>') for i in range(1, 4)]
+
+    def missing_metadata(rating_key):
+        raise Exception("Failed to get metadata: 404")
+
+    show = Show()
+    monkeypatch.setattr(plex_poster_set_helper, "SHOW_TREES", {})
+    monkeypatch.setattr(plex_poster_set_helper, "get_plex_metadata", missing_metadata)
+    assert plex_poster_set_helper.find_season(show, 0).title == "Specials"
+    assert plex_poster_set_helper.find_episode(show, 1, 3).title == "Episode 3"
+    with pytest.raises(KeyError):
+        plex_poster_set_helper.find_episode(show, 2, 1)
+    assert calls == ["seasons", "episodes"]
+
+    # Seasons are taken from the show's cached metadata when it has them, only episodes are fetched
+    season = plex_poster_set_helper.ET.fromstring('<Directory ratingKey="8" type="season" title="Season 1" index="1" parentTitle="Show"/>')
+    children = [{"rating_key": "8", "type": "season", "index": "1", "title": "Season 1", "element": season}]
+    monkeypatch.setattr(plex_poster_set_helper, "get_plex_metadata", lambda rating_key: {"children": children})
+    plex_poster_set_helper.SHOW_TREES.clear()
+    calls.clear()
+    assert plex_poster_set_helper.find_season(show, 1).ratingKey == 8
+    assert plex_poster_set_helper.find_episode(show, 1, 2).title == "Episode 2"
+    assert calls == ["episodes"]
+
+
+def test_fetch_page_uses_disk_cache(monkeypatch, tmp_path):
+    responses = [FakeResponse("<html>v1</html>", headers={"ETag": '"v1"'}), FakeResponse("", status_code=304)]
+    sent_headers = []
+
+    def fake_http_get(url, headers=None, **kwargs):
+        sent_headers.append(headers)
+        return responses.pop(0)
+
+    monkeypatch.setattr(plex_poster_set_helper, "http_get", fake_http_get)
+    monkeypatch.setattr(plex_poster_set_helper, "page_cache_directory", str(tmp_path))
+    monkeypatch.setattr(plex_poster_set_helper, "page_cache_ttl", 3600)
+
+    url = "https://mediux.pro/sets/9242"
+    assert plex_poster_set_helper.fetch_page(url) == "<html>v1</html>"
+    assert plex_poster_set_helper.fetch_page(url) == "<html>v1</html>"
+    assert len(sent_headers) == 1
+
+    # Once stale the page is revalidated with its ETag
+    monkeypatch.setattr(plex_poster_set_helper, "page_cache_ttl", 0)
+    assert plex_poster_set_helper.fetch_page(url) == "<html>v1</html>"
+    assert sent_headers[1]["If-None-Match"] == '"v1"'
+
+
+def test_parsed_sets_are_reused_while_the_payload_is_unchanged(monkeypatch, tmp_path):
+    pages = {"https://theposterdb.com/set/1": '<meta name="csrf-token" content="a"><div class="row d-flex flex-wrap m-0 w-100 mx-n1 mt-n1">x</div>'}
+    parsed = []
+
+    def parse(soup):
+        parsed.append(soup)
+        return [{"title": "Alien", "url": "u", "year": 1979, "source": "posterdb"}], [], []
+
+    monkeypatch.setattr(plex_poster_set_helper, "fetch_page", lambda url: pages[url])
+    monkeypatch.setattr(plex_poster_set_helper, "parsed_set_directory", str(tmp_path))
+
+    url = "https://theposterdb.com/set/1"
+    first = plex_poster_set_helper.scrape_set_page("posterdb", url, parse)
+    pages[url] = pages[url].replace('content="a"', 'content="b"')
+    assert plex_poster_set_helper.scrape_set_page("posterdb", url, parse) == first
+    assert len(parsed) == 1
+
+    plex_poster_set_helper.invalidate_parsed_set("posterdb", "1")
+    plex_poster_set_helper.scrape_set_page("posterdb", url, parse)
+    assert len(parsed) == 2
+
+
+def test_unchanged_posters_are_skipped(monkeypatch, tmp_path):
+    uploaded = []
+    monkeypatch.setattr(plex_poster_set_helper, "upload_tv_poster", lambda poster, libraries: uploaded.append(poster["url"]))
+    monkeypatch.setattr(plex_poster_set_helper, "overwrite_existing_assets", False)
+    monkeypatch.setattr(plex_poster_set_helper, "STATE_DB", None)
+    plex_poster_set_helper.open_state_database(str(tmp_path / "state.db"))
+
+    asset = tmp_path / "Season01.jpg"
+    asset.write_bytes(b"jpeg")
+    poster = {"title": "Andor", "id": 393189, "season": 1, "episode": "Cover", "url": "https://mediux.pro/a", "source": "mediux"}
+    plex_poster_set_helper.record_upload(plex_poster_set_helper.asset_slot(poster, "show"), 5, poster["url"], str(asset))
+
+    changed = dict(poster, season=2, url="https://mediux.pro/b")
+    plex_poster_set_helper.process_posters([], [poster, changed], [])
+    assert uploaded == ["https://mediux.pro/b"]
+
+    # Only the batch's slots are read, in chunks, however many the database holds
+    for number in range(1200):
+        plex_poster_set_helper.record_upload(f"slot-{number}", number, f"https://mediux.pro/{number}", None)
+    sources = plex_poster_set_helper.uploaded_sources([f"slot-{number}" for number in range(0, 2400, 2)])
+    assert sources == {f"slot-{number}": f"https://mediux.pro/{number}" for number in range(0, 1200, 2)}
+
+
+mediux_page = fixture_corpus.mediux_page
+
+
+def test_mediux_user_pages_are_fetched_once(monkeypatch):
+    links = '<a href="?page=2">2</a><a href="?page=3">3</a>'
+    pages = {
+        1: mediux_page({"files": [], "sets": [{"id": 1}, {"id": 2, "boxset": {"id": 9}}]}, links),
+        2: mediux_page({"files": [], "sets": [{"id": 1}, {"id": 3}]}, links),
+        3: mediux_page({"files": [], "sets": [{"id": 4}]}, links),
+    }
+    fetched, processed = [], []
+
+    def fake_fetch_page(url):
+        fetched.append(url)
+        return pages[int(url.split("page=")[1])]
+
+    monkeypatch.setattr(plex_poster_set_helper, "fetch_page", fake_fetch_page)
+    monkeypatch.setattr(plex_poster_set_helper, "process_ids", lambda set_ids, boxset_ids: processed.extend(set_ids + [f"box{i}" for i in boxset_ids]))
+    plex_poster_set_helper.scrape_mediux_user("https://mediux.pro/user/someone")
+
+    assert sorted(fetched) == [f"https://mediux.pro/user/someone/sets?page={page}" for page in (1, 2, 3)]
+    assert sorted(map(str, processed)) == ["1", "3", "4", "box9"]
+
+
+def test_posterdb_user_pages_merge_into_one_queue(monkeypatch):
+    alien = {"title": "Alien", "url": "https://theposterdb.com/api/assets/1", "year": 1979, "source": "posterdb"}
+    aliens = {"title": "Aliens", "url": "https://theposterdb.com/api/assets/2", "year": 1986, "source": "posterdb"}
+    page_results = {1: ([alien], [], []), 2: ([alien, aliens], [], [])}
+    processed = []
+
+    monkeypatch.setattr(plex_poster_set_helper, "cook_soup", lambda url: plex_poster_set_helper.BeautifulSoup('<span class="numCount" data-count="30"></span>', "html.parser"))
+    monkeypatch.setattr(plex_poster_set_helper, "scrape_set_page", lambda source, url, parse: page_results[int(url.split("page=")[1])])
+    monkeypatch.setattr(plex_poster_set_helper, "process_posters", lambda *posters: processed.append(posters))
+    plex_poster_set_helper.scrape_entire_user("https://theposterdb.com/user/someone")
+
+    assert processed == [([alien, aliens], [], [])]
+
+
+def test_boxset_children_are_merged_and_errors_reported(monkeypatch, capsys):
+    andor = {"title": "Andor", "season": "Cover", "episode": None, "url": "https://mediux.pro/a", "source": "mediux"}
+
+    def fake_scrape(url):
+        if url.endswith("/2"):
+            raise Exception("boom")
+        return [], [andor], []
+
+    soup = plex_poster_set_helper.BeautifulSoup(mediux_page({"files": [], "set": 1, "boxset": {"sets": [{"id": 1}, {"id": 2}, {"id": 3}]}}), "html.parser")
+    monkeypatch.setattr(plex_poster_set_helper, "scrape", fake_scrape)
+    assert plex_poster_set_helper.process_boxset_url(5, soup) == ([], [andor], [])
+    assert "Error processing https://mediux.pro/sets/2: boom" in capsys.readouterr().out
+
+
+def test_bulk_mode_scrapes_each_set_once_and_last_line_wins(monkeypatch):
+    expansions = {
+        "https://mediux.pro/user/someone": ["https://mediux.pro/sets/1", "https://mediux.pro/sets/2"],
+        "https://mediux.pro/boxsets/9": ["https://mediux.pro/sets/2"],
+        "https://theposterdb.com/set/7": ["https://theposterdb.com/set/7"],
+    }
+    cover = {"media_type": "Show", "title": "Andor", "id": 393189, "season": "Cover", "episode": None, "source": "mediux"}
+    set_results = {
+        "https://mediux.pro/sets/1": ([], [dict(cover, url="https://mediux.pro/from-set-1")], []),
+        "https://mediux.pro/sets/2": ([], [dict(cover, season=1, episode="Cover", url="https://mediux.pro/season")], []),
+        "https://theposterdb.com/set/7": ([], [dict(cover, url="https://mediux.pro/from-set-7")], []),
+    }
+    scraped = []
+
+    def fake_scrape_set_url(url):
+        scraped.append(url)
+        return set_results[url]
+
+    monkeypatch.setattr(plex_poster_set_helper, "expand_url", lambda url: expansions[url])
+    monkeypatch.setattr(plex_poster_set_helper, "scrape_set_url", fake_scrape_set_url)
+    monkeypatch.setattr(plex_poster_set_helper, "tv", [])
+
+    movieposters, showposters, collectionposters = plex_poster_set_helper.collect_bulk_posters(list(expansions))
+    assert sorted(scraped) == sorted(set_results)
+    assert [poster["url"] for poster in showposters] == ["https://mediux.pro/from-set-7", "https://mediux.pro/season"]
+
+
+def test_bulk_mode_only_looks_up_changed_slots_in_the_worker_pool(monkeypatch, tmp_path):
+    monkeypatch.setattr(plex_poster_set_helper, "overwrite_existing_assets", False)
+    monkeypatch.setattr(plex_poster_set_helper, "STATE_DB", None)
+    plex_poster_set_helper.open_state_database(str(tmp_path / "state.db"))
+    cover = {"media_type": "Show", "title": "Andor", "id": 393189, "season": "Cover", "episode": None, "source": "mediux", "url": "https://mediux.pro/a"}
+    season = dict(cover, season=1, episode="Cover", url="https://mediux.pro/b")
+    plex_poster_set_helper.record_upload(plex_poster_set_helper.asset_slot(cover, "show"), 5, cover["url"], None)
+    looked_up = []
+
+    def fake_upload_target_key(kind, poster):
+        looked_up.append((poster["url"], plex_poster_set_helper.threading.current_thread() is plex_poster_set_helper.threading.main_thread()))
+        return poster["url"]
+
+    monkeypatch.setattr(plex_poster_set_helper, "expand_url", lambda url: [url])
+    monkeypatch.setattr(plex_poster_set_helper, "scrape_set_url", lambda url: ([], [cover, season, dict(season)], []))
+    monkeypatch.setattr(plex_poster_set_helper, "upload_target_key", fake_upload_target_key)
+
+    movieposters, showposters, collectionposters = plex_poster_set_helper.collect_bulk_posters(["https://mediux.pro/sets/1"])
+    assert showposters == [season]
+    assert looked_up == [("https://mediux.pro/b", False)]
+
+
+def test_mediux_scripts_match_with_and_without_soup():
+    html = mediux_page({"files": [{"id": "a"}], "set": {"id": 1}}) + '<script>self.__next_f.push([1,"other"])</script>'
+    soup = plex_poster_set_helper.BeautifulSoup(html, "html.parser")
+    assert plex_poster_set_helper.mediux_data_scripts(html) == plex_poster_set_helper.mediux_data_scripts(soup)
+    assert plex_poster_set_helper.parse_string_to_dict(plex_poster_set_helper.mediux_data_scripts(html)[0])["files"] == [{"id": "a"}]
+
+
+def test_scrape_mediux_show_set(monkeypatch):
+    seasons = [{"id": 50 + number, "season_number": number, "episodes": [{"id": number * 100 + episode, "episode_number": episode} for episode in range(1, 4)]} for number in (1, 2)]
+    files = [{"id": "show", "show_id": {"id": 1}}, {"id": "backdrop", "fileType": "backdrop", "show_id_backdrop": {"id": 1}}]
+    for season in seasons:
+        files.append({"id": f"season{season['season_number']}", "season_id": {"id": season["id"]}})
+        files.extend({"id": f"card{episode['id']}", "fileType": "title_card",
+                      "episode_id": {"id": episode["id"], "season_id": {"season_number": season["season_number"]}}} for episode in season["episodes"])
+    html = mediux_page({"set": {"files": files, "show": {"name": "Andor", "tvdb_id": 393189, "first_air_date": "2022-09-21", "seasons": seasons}}})
+
+    monkeypatch.setattr(plex_poster_set_helper, "get_mediux_filters", lambda: ["title_card", "season_cover", "show_cover"])
+    movieposters, showposters, collectionposters = plex_poster_set_helper.scrape_mediux(html)
+    assert movieposters == [] and collectionposters == []
+    assert [(poster["season"], poster["episode"]) for poster in showposters] == [
+        ("Cover", None), (1, "Cover"), (1, 1), (1, 2), (1, 3), (2, "Cover"), (2, 1), (2, 2), (2, 3)]
+    assert all(poster["year"] == 2022 and poster["id"] == 393189 for poster in showposters)
+
+
+def test_parser_benchmark_tells_sites_apart_and_restores_the_parser(monkeypatch, tmp_path):
+    monkeypatch.setattr(plex_poster_set_helper, "html_parser", None)
+    pages = fixture_corpus.synthetic_pages()
+    posterdb = benchmark_parsers.benchmark_page(pages["https://theposterdb.com/set/8846"], ["html.parser"], 1)
+    mediux = benchmark_parsers.benchmark_page(pages["https://mediux.pro/sets/9242"], ["html.parser"], 1)
+
+    assert [row[0] for row in posterdb] == ["parse (html.parser)", "scrape_posterdb (html.parser)"]
+    assert [row[0] for row in mediux] == ["parse (html.parser)", "script scan"]
+    assert all(len(row) == 4 and row[3] > 0 for row in posterdb + mediux)
+    assert plex_poster_set_helper.html_parser is None
+    assert benchmark_parsers.saved_pages(str(tmp_path)) == pages
+
+
+def corpus_counts(url, html):
+    # What each kind of page yields: posters for sets and boxsets, set and boxset IDs for user pages
+    if "/boxsets/" in url:
+        result = plex_poster_set_helper.process_boxset_url(url.rstrip("/").split("/")[-1], html)
+    elif "/user/" in url:
+        set_ids, boxset_ids = plex_poster_set_helper.extract_ids_from_script(html)
+        return {"sets": len(set_ids), "boxsets": len(boxset_ids)}
+    elif "mediux.pro" in url:
+        result = plex_poster_set_helper.scrape_mediux(html)
+    else:
+        result = plex_poster_set_helper.scrape_posterdb(html)
+    return dict(zip(("movies", "shows", "collections"), map(len, result)))
+
+
+@pytest.mark.parametrize("name", sorted(name for name, entry in fixture_corpus.load_manifest().items() if "expected" in entry))
+@pytest.mark.parametrize("corpus", ["synthetic", "recorded"])
+def test_corpus_pages_yield_the_manifest_counts(name, corpus, monkeypatch):
+    # The synthetic stand-ins are built to these counts; recorded pages are checked once they exist
+    manifest = fixture_corpus.load_manifest()
+    pages = fixture_corpus.synthetic_pages() if corpus == "synthetic" else fixture_corpus.recorded_pages(manifest)
+    entry = manifest[name]
+    if entry["url"] not in pages:
+        pytest.skip(f"{name} has not been recorded")
+    monkeypatch.setattr(plex_poster_set_helper, "fetch_page", fixture_corpus.offline_fetch_page(pages))
+    monkeypatch.setattr(plex_poster_set_helper, "parsed_set_cache", False)
+    monkeypatch.setattr(plex_poster_set_helper, "get_mediux_filters", lambda: None)
+
+    assert corpus_counts(entry["url"], pages[entry["url"]]) == entry["expected"]
+
+
+@pytest.mark.parametrize("url", sorted(fixture_corpus.SYNTHETIC_EXPECTED))
+def test_synthetic_boxset_and_user_pages_yield_their_counts(url, monkeypatch):
+    pages = fixture_corpus.synthetic_pages()
+    monkeypatch.setattr(plex_poster_set_helper, "fetch_page", fixture_corpus.offline_fetch_page(pages))
+    monkeypatch.setattr(plex_poster_set_helper, "parsed_set_cache", False)
+    monkeypatch.setattr(plex_poster_set_helper, "get_mediux_filters", lambda: None)
+
+    assert corpus_counts(url, pages[url]) == fixture_corpus.SYNTHETIC_EXPECTED[url]
+
+
+@pytest.fixture
+def fake_plex(monkeypatch, tmp_path):
+    # A fake Plex server holding Andor (one season of two episodes) and Alien, and a function that
+    # runs plex_setup against it with extra config; plex_setup replaces module state, so it is restored afterwards
+    library = fake_plex_server.FakePlexLibrary()
+    tv_section = library.add_section("TV Shows", "show")
+    movie_section = library.add_section("Movies", "movie")
+    andor = library.add_show(tv_section, "Andor", 2022, ["tvdb://393189"], {1: 2})
+    library.add_movie(movie_section, "Alien", 1979)
+
+    for name in ["tv", "movies", "plex_collections", "append_label", "overwrite_labelled_shows", "assets_directory", "base_url", "token",
+                 "asset_folders", "useragent", "max_workers", "max_upload_workers", "upload_semaphore", "rate_limiter", "collection_cache_ttl",
+                 "http_pool_size", "http_timeout", "http_retries", "http_backoff", "page_cache", "page_cache_directory", "page_cache_ttl",
+                 "page_cache_max_size", "parsed_set_cache", "parsed_set_directory", "state_database", "html_parser", "overwrite_existing_assets",
+                 "only_process_new_assets", "upload_mode", "asset_store", "asset_store_max_size",
+                 "skip_identical_uploads"]:
+        monkeypatch.setattr(plex_poster_set_helper, name, getattr(plex_poster_set_helper, name, None), raising=False)
+    for name in ["LIBRARY_INDEX", "COLLECTION_CACHE", "HTTP_SESSIONS", "METADATA_CACHE", "SHOW_TREES", "METADATA_LOCKS", "NAMED_LOCKS"]:
+        monkeypatch.setattr(plex_poster_set_helper, name, {})
+    monkeypatch.setattr(plex_poster_set_helper, "STORED_ASSETS", set())
+    monkeypatch.setattr(plex_poster_set_helper, "STATE_DB", None)
+    monkeypatch.setattr(plex_poster_set_helper, "LABELLED_THIS_RUN", set())
+
+    with fake_plex_server.FakePlexServer(library, token="secret") as server:
+        def setup(**config):
+            monkeypatch.chdir(tmp_path)
+            config = {"base_url": server.url, "token": "secret", "tv_library": "TV Shows", "movie_library": "Movies",
+                      "page_cache": False, "parsed_set_cache": False, "state_database": None, **config}
+            (tmp_path / "config.json").write_text(plex_poster_set_helper.json.dumps(config))
+            plex_poster_set_helper.plex_setup()
+            monkeypatch.setattr(plex_poster_set_helper, "rate_limiter", plex_poster_set_helper.RateLimiter({"plex": 0}, start_interval=0.0))
+            monkeypatch.setattr(plex_poster_set_helper, "http_get", benchmark_end_to_end.local_downloads(server))
+        yield library, andor, server, setup
+
+
+def test_http_sessions_follow_the_config(fake_plex):
+    library, andor, server, setup = fake_plex
+    setup(http_timeout=12, http_retries=5, http_pool_size=4)
+    adapter = plex_poster_set_helper.get_http_session("https://mediux.pro/sets/1").get_adapter("https://mediux.pro/sets/1")
+    assert plex_poster_set_helper.http_timeout == (12, 12)
+    assert adapter.max_retries.total == 5
+    assert adapter._pool_maxsize == 4
+
+    setup(http_timeout=[3, 60])
+    assert plex_poster_set_helper.http_timeout == (3, 60)
+    with pytest.raises(SystemExit, match="http_timeout"):
+        setup(http_timeout="fast")
+
+
+def andor_and_alien_posters():
+    show = {"media_type": "Show", "title": "Andor", "id": 393189, "year": 2022, "source": "mediux"}
+    showposters = [dict(show, season="Cover", episode=None, url="https://mediux.pro/a"), dict(show, season=1, episode="Cover", url="https://mediux.pro/b"),
+                   dict(show, season=1, episode=2, url="https://mediux.pro/c")]
+    movieposters = [{"title": "Alien", "year": 1979, "url": "https://theposterdb.com/api/assets/1", "source": "posterdb"}]
+    return movieposters, showposters, []
+
+
+@pytest.mark.parametrize("mode", ["file", "url", "hybrid"])
+def test_posters_upload_end_to_end_against_the_fake_plex_server(mode, fake_plex, tmp_path):
+    library, andor, server, setup = fake_plex
+    setup(upload_mode=mode)
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+
+    assert server.uploads == 4
+    assert library.items[andor]["labels"] == ["Overlay"]
+    assert (tmp_path / "assets" / "tv" / "Andor (2022)" / "S01E02.jpg").exists() == (mode != "url")
+    assert (tmp_path / "assets" / "movies" / "Alien (1979)" / "poster.jpg").exists() == (mode != "url")
+    # URL uploads leave Plex with the source URL, file uploads with a hash of the uploaded file
+    episode = library.leaves(andor)[1]
+    assert (library.items[episode]["posters"][-1]["ratingKey"] == "https://mediux.pro/c") == (mode != "file")
+
+
+@pytest.mark.parametrize("workers", [1, 8])
+def test_only_items_labelled_by_an_earlier_run_are_skipped(workers, fake_plex):
+    library, andor, server, setup = fake_plex
+    setup(max_workers=workers)
+    plex_poster_set_helper.overwrite_labelled_shows = False
+    movieposters, showposters, _ = andor_and_alien_posters()
+    showposters.append(dict(showposters[-1], episode=1, url="https://mediux.pro/d"))
+    plex_poster_set_helper.process_posters([], showposters, [])
+
+    # The first upload labels Andor, the rest of the set still goes through however it is scheduled
+    assert server.uploads == 4
+    assert library.items[andor]["labels"] == ["Overlay"]
+
+    # A later run skips the labelled show
+    plex_poster_set_helper.LABELLED_THIS_RUN.clear()
+    server.reset_stats()
+    plex_poster_set_helper.process_posters([], showposters, [])
+    assert server.uploads == 0
+
+
+def test_assets_mode_only_writes_asset_folders(fake_plex, tmp_path):
+    library, andor, server, setup = fake_plex
+    setup(upload_mode="assets")
+    server.reset_stats()
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+
+    assert sorted(path.name for path in (tmp_path / "assets" / "tv" / "Andor (2022)").iterdir()) == ["S01E02.jpg", "Season01.jpg", "poster.jpg"]
+    assert (tmp_path / "assets" / "movies" / "Alien (1979)" / "poster.jpg").exists()
+    # Folders came from the library index, nothing was uploaded, locked or labelled
+    assert set(server.requests) == {"GET /images/{name}"}
+    assert library.items[andor]["labels"] == []
+
+
+def test_asset_store_links_each_image_once_and_evicts_unused_ones(fake_plex, tmp_path, capsys):
+    library, andor, server, setup = fake_plex
+    setup(upload_mode="assets", asset_store_max_size=0)
+    movieposters, showposters, _ = andor_and_alien_posters()
+    showposters[1]["url"] = showposters[0]["url"]
+    store = tmp_path / "assets" / ".store"
+    store.mkdir(parents=True)
+    (store / "url-unused.jpg").write_bytes(b"old")
+    server.reset_stats()
+    plex_poster_set_helper.process_posters(movieposters, showposters, [])
+
+    show_folder = tmp_path / "assets" / "tv" / "Andor (2022)"
+    assert server.requests["GET /images/{name}"] == 3
+    assert (show_folder / "poster.jpg").samefile(show_folder / "Season01.jpg")
+    assert (show_folder / "poster.jpg").samefile(store / "mediux-a.jpg")
+    assert plex_poster_set_helper.asset_store_name("https://mediux.pro/_next/image?url=https%3A%2F%2Fapi.mediux.pro%2Fassets%2Fabc-123&w=3840&q=80") == "mediux-abc-123.jpg"
+    assert plex_poster_set_helper.asset_store_name("https://theposterdb.com/api/assets/8846") == "posterdb-8846.jpg"
+    # The store is reported and trimmed once per command, only the image no asset file links to is evicted
+    assert "Asset store" not in capsys.readouterr().out
+    plex_poster_set_helper.report_asset_store("assets")
+    assert sorted(path.name for path in store.iterdir()) == ["mediux-a.jpg", "mediux-c.jpg", "posterdb-1.jpg"]
+    output = capsys.readouterr().out
+    assert "Asset store: 4 images" in output and "4 asset files" in output and "evicted 1 unused images" in output
+
+    # A later run links the stored images without downloading them again
+    (show_folder / "S01E02.jpg").unlink()
+    server.reset_stats()
+    plex_poster_set_helper.process_posters(movieposters, showposters, [])
+    assert (show_folder / "S01E02.jpg").samefile(store / "mediux-c.jpg")
+    assert server.requests["GET /images/{name}"] == 0
+
+
+def test_asset_store_keeps_images_that_were_copied(fake_plex, tmp_path, monkeypatch, capsys):
+    library, andor, server, setup = fake_plex
+    setup(upload_mode="assets", asset_store_max_size=0)
+    monkeypatch.setattr(plex_poster_set_helper.os, "link", lambda *args: (_ for _ in ()).throw(OSError("no hard links")))
+    monkeypatch.setattr(plex_poster_set_helper.os, "symlink", lambda *args: (_ for _ in ()).throw(OSError("no symlinks")))
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+
+    store = tmp_path / "assets" / ".store"
+    assert (tmp_path / "assets" / "tv" / "Andor (2022)" / "S01E02.jpg").read_bytes() == (store / "mediux-c.jpg").read_bytes()
+    # Copies do not count as users of their image, so nothing can safely be evicted
+    plex_poster_set_helper.report_asset_store("assets")
+    assert len([path for path in store.iterdir() if path.suffix == ".jpg"]) == 4
+    assert "unused images cannot be told apart and are kept" in capsys.readouterr().out
+
+    plex_poster_set_helper.asset_store = False
+    plex_poster_set_helper.report_asset_store("assets")
+    assert capsys.readouterr().out == ""
+
+
+def test_overwrite_runs_only_transfer_changed_images(fake_plex, tmp_path):
+    library, andor, server, setup = fake_plex
+    setup(upload_mode="assets", state_database="state.db")
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+
+    # Unchanged images are answered with 304 Not Modified, the changed one is downloaded again
+    server.images["https://mediux.pro/c"] = b"new episode card"
+    server.reset_stats()
+    plex_poster_set_helper.overwrite_existing_assets = True
+    plex_poster_set_helper.STORED_ASSETS.clear()
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+
+    assert server.image_statuses == {304: 3, 200: 1}
+    assert server.image_bytes == len(b"new episode card")
+    assert (tmp_path / "assets" / "tv" / "Andor (2022)" / "S01E02.jpg").read_bytes() == b"new episode card"
+
+
+def test_interrupted_downloads_resume_from_the_part_file(fake_plex, tmp_path):
+    library, andor, server, setup = fake_plex
+    setup(state_database="state.db")
+    image = bytes(range(256)) * 64
+    server.images["https://mediux.pro/a"] = image
+    file_path = tmp_path / "poster.jpg"
+    # A first attempt that was cut off after 1000 bytes
+    (tmp_path / "poster.jpg.part").write_bytes(image[:1000])
+    response = FakeResponse(b"", headers={"ETag": f'"{fake_plex_server.hashlib.sha1(image).hexdigest()[:16]}"'})
+    plex_poster_set_helper.record_download(f"{file_path}.part", "https://mediux.pro/a", response, len(image))
+
+    assert plex_poster_set_helper.download_file("https://mediux.pro/a", str(file_path)) == str(file_path)
+    assert file_path.read_bytes() == image
+    assert not (tmp_path / "poster.jpg.part").exists()
+    assert server.image_statuses == {206: 1}
+    assert server.image_bytes == len(image) - 1000
+
+    # The server no longer has that version, so the next partial download starts over
+    (tmp_path / "poster.jpg.part").write_bytes(b"stale")
+    plex_poster_set_helper.record_download(f"{file_path}.part", "https://mediux.pro/a", FakeResponse(b"", headers={"ETag": '"old"'}), 100)
+    server.images["https://mediux.pro/a"] = b"replaced"
+    assert plex_poster_set_helper.download_file("https://mediux.pro/a", str(file_path)) == str(file_path)
+    assert file_path.read_bytes() == b"replaced"
+
+
+def test_downloads_to_the_same_file_do_not_mix(fake_plex, tmp_path):
+    library, andor, server, setup = fake_plex
+    setup(state_database="state.db")
+    server.images["https://mediux.pro/a"] = b"A" * 3 * 1024 * 1024
+    server.images["https://mediux.pro/b"] = b"B" * 5 * 1024 * 1024
+    file_path = str(tmp_path / "poster.jpg")
+    urls = ["https://mediux.pro/a", "https://mediux.pro/b"] * 4
+    with plex_poster_set_helper.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda url: plex_poster_set_helper.download_file(url, file_path), urls))
+
+    assert results == [file_path] * len(urls)
+    assert (tmp_path / "poster.jpg").read_bytes() in (server.images["https://mediux.pro/a"], server.images["https://mediux.pro/b"])
+    assert not list(tmp_path.glob("poster.jpg.*"))
+
+
+def test_identical_uploads_are_skipped_by_recorded_hash(fake_plex, tmp_path):
+    library, andor, server, setup = fake_plex
+    setup(state_database="state.db")
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+    assert server.uploads == 4
+
+    # A refresh re-checks every image, but only the one that changed reaches Plex
+    server.images["https://mediux.pro/c"] = b"new episode card"
+    server.reset_stats()
+    plex_poster_set_helper.overwrite_existing_assets = True
+    plex_poster_set_helper.STORED_ASSETS.clear()
+    movieposters, showposters, _ = andor_and_alien_posters()
+    plex_poster_set_helper.process_posters(movieposters, showposters, [])
+    assert server.uploads == 1
+    assert not any(name.endswith(("/posters", "/arts")) and name.startswith("GET") for name in server.requests)
+
+
+@pytest.mark.parametrize("mode", ["file", "url"])
+def test_identical_uploads_are_skipped_by_the_selected_plex_art(mode, fake_plex, tmp_path):
+    library, andor, server, setup = fake_plex
+    setup(upload_mode=mode)
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+    assert server.uploads == 4
+
+    # Without a state database, items labelled by an earlier run are compared with the art Plex has selected
+    plex_poster_set_helper.LABELLED_THIS_RUN.clear()
+    server.reset_stats()
+    plex_poster_set_helper.overwrite_labelled_shows = True
+    plex_poster_set_helper.overwrite_existing_assets = True
+    plex_poster_set_helper.STORED_ASSETS.clear()
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+    assert server.uploads == 0
+    assert server.requests["GET /library/metadata/{id}/posters"] == 4
+
+    plex_poster_set_helper.skip_identical_uploads = False
+    plex_poster_set_helper.process_posters(*andor_and_alien_posters())
+    assert server.uploads == 4
+
+
+def test_local_pages_are_parsed_in_processes_and_uploaded_once(monkeypatch, tmp_path, capsys):
+    pages = fixture_corpus.synthetic_pages()
+    (tmp_path / "b.html").write_text(pages["https://theposterdb.com/set/13035"], encoding="utf-8")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "a.html").write_text(pages["https://mediux.pro/sets/9242"], encoding="utf-8")
+    (tmp_path / "c.html").write_text(pages["https://theposterdb.com/set/13035"], encoding="utf-8")
+    (tmp_path / "notes.html").write_text("<html><body>nothing here</body></html>", encoding="utf-8")
+    assert plex_poster_set_helper.detect_page_source(pages["https://mediux.pro/sets/9242"]) == "mediux"
+    assert plex_poster_set_helper.detect_page_source(pages["https://theposterdb.com/set/8846"]) == "posterdb"
+
+    uploaded = []
+    monkeypatch.setattr(plex_poster_set_helper, "upload_tv_poster", lambda poster, libraries: uploaded.append(poster["url"]))
+    monkeypatch.setattr(plex_poster_set_helper, "upload_movie_poster", lambda poster, libraries: uploaded.append(poster["url"]))
+    monkeypatch.setattr(plex_poster_set_helper, "upload_collection_poster", lambda poster, libraries: uploaded.append(poster["url"]))
+    monkeypatch.setattr(plex_poster_set_helper, "local_parse_workers", 2)
+    plex_poster_set_helper.parse_local_files(str(tmp_path))
+
+    assert len(uploaded) == len(set(uploaded)) == 11 + 4
+    assert f"Error parsing {tmp_path / 'notes.html'}: Not a saved ThePosterDB or MediUX page" in capsys.readouterr().out